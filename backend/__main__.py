@@ -0,0 +1,26 @@
+"""
+ResearchGPT Backend - production entry point (python -m backend)
+
+Kept apart from backend.main: worker processes started with "spawn"
+re-import the entry module, and this one doesn't pull in the app and
+its models.
+"""
+import os
+
+import uvicorn
+
+
+if __name__ == "__main__":
+    # One worker process per core by default; uvicorn picks uvloop and
+    # httptools automatically when installed (uvicorn[standard])
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    
+    # Workers size their own process pools from this
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    
+    uvicorn.run(
+        "backend.main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers
+    )
@@ -2,13 +2,18 @@
 ResearchGPT Backend - FastAPI Application
 AI-powered Research Paper Assistant using RAG
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import os
+import asyncio
 from dotenv import load_dotenv
 
 from .services.vector_store import VectorStore
+from .services.pdf_parser import shutdown_parse_executor
+from .services.embeddings import get_embedding_service
+from .services.paper_store import STATUS_READY, get_paper_store
 
 # Load environment variables
 load_dotenv()
@@ -17,6 +22,17 @@ load_dotenv()
 vector_store: VectorStore = None
 
 
+async def _sync_local_index():
+    """Mirror papers stored in Pinecone into the local binary index, if enabled"""
+    try:
+        papers = await get_paper_store().list_papers()
+        await vector_store.sync_local_index([
+            paper["paper_id"] for paper in papers if paper["status"] == STATUS_READY
+        ])
+    except Exception as e:
+        print(f"⚠️ Local index sync failed, using Pinecone for all-paper queries: {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan - initialize and cleanup resources"""
@@ -28,10 +44,21 @@ async def lifespan(app: FastAPI):
     await vector_store.initialize()
     print("✅ Vector store connected")
     
+    # Papers left processing by a server that stopped mid-ingest
+    stale = await get_paper_store().fail_stale_papers()
+    if stale:
+        print(f"⚠️ Marked {stale} interrupted uploads as failed")
+    
+    # Fill the local index in the background; queries use Pinecone meanwhile
+    sync_task = asyncio.create_task(_sync_local_index())
+    
     yield
     
     # Cleanup on shutdown
     print("👋 Shutting down ResearchGPT backend...")
+    sync_task.cancel()
+    shutdown_parse_executor()
+    get_embedding_service().shutdown()
 
 
 app = FastAPI(
@@ -41,7 +68,22 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# CORS middleware for React frontend
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Reject oversized uploads from their Content-Length before the body is read"""
+    if request.url.path == "/api/upload_paper":
+        from .routers.papers import MAX_UPLOAD_BYTES
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"File too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)"}
+            )
+    return await call_next(request)
+
+
+# CORS middleware for React frontend (added last so it also wraps rejected uploads)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allow all origins temporarily for debugging
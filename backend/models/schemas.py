@@ -25,6 +25,7 @@ class PaperMetadata(BaseModel):
     upload_date: datetime
     total_pages: int = 0
     total_chunks: int = 0
+    status: str = "ready"  # processing, ready or failed
 
 
 class PaperUploadResponse(BaseModel):
@@ -35,6 +36,16 @@ class PaperUploadResponse(BaseModel):
     message: str
     total_chunks: int = 0
     total_pages: int = 0
+    status: str = "processing"
+
+
+class PaperStatusResponse(BaseModel):
+    """Processing status of an uploaded paper"""
+    paper_id: str
+    status: str  # processing, ready or failed
+    error: Optional[str] = None
+    total_chunks: int = 0
+    total_pages: int = 0
 
 
 class PaperListResponse(BaseModel):
@@ -2,6 +2,7 @@
 Prompt Templates for ResearchGPT
 Academic Q&A prompts with different response modes
 """
+from collections import OrderedDict
 
 # System prompt for academic research assistant
 SYSTEM_PROMPT = """You are an expert AI research paper assistant. Your role is to help students and researchers understand academic papers by providing accurate, well-structured answers based on the provided context.
@@ -99,20 +100,33 @@ def get_prompt(mode: str = "academic") -> str:
     return prompts.get(mode, ACADEMIC_PROMPT)
 
 
+# Recently formatted contexts, keyed by the retrieved chunk set
+CONTEXT_CACHE_SIZE = 512
+_context_cache: "OrderedDict[tuple, str]" = OrderedDict()
+
+
 def format_context(chunks: list) -> str:
     """Format retrieved chunks into context string"""
-    context_parts = []
+    # Chunk IDs identify immutable chunk text, so (id, length) pairs make
+    # a cheap key that doesn't hash the full text
+    key = tuple((chunk.get("chunk_id"), len(chunk.get("text", ""))) for chunk in chunks)
+    cacheable = all(chunk_id for chunk_id, _ in key)
+    
+    if cacheable and key in _context_cache:
+        _context_cache.move_to_end(key)
+        return _context_cache[key]
+    
+    context = "\n\n---\n\n".join([
+        f"[Source {i} - {chunk.get('section', 'Unknown Section')}, Page {chunk.get('page', 0)}]\n{chunk.get('text', '')}"
+        for i, chunk in enumerate(chunks, 1)
+    ])
     
-    for i, chunk in enumerate(chunks, 1):
-        section = chunk.get("section", "Unknown Section")
-        page = chunk.get("page", 0)
-        text = chunk.get("text", "")
-        
-        context_parts.append(
-            f"[Source {i} - {section}, Page {page}]\n{text}"
-        )
+    if cacheable:
+        _context_cache[key] = context
+        if len(_context_cache) > CONTEXT_CACHE_SIZE:
+            _context_cache.popitem(last=False)
     
-    return "\n\n---\n\n".join(context_parts)
+    return context
 
 
 def build_prompt(question: str, chunks: list, mode: str = "academic") -> str:
@@ -4,20 +4,34 @@ Endpoints for uploading, listing, and deleting papers
 """
 import os
 import uuid
-import json
+import asyncio
 from datetime import datetime
 from pathlib import Path
 from typing import List
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, HTTPException
 
 from ..models.schemas import (
     PaperUploadResponse,
     PaperListResponse,
     PaperDeleteResponse,
-    PaperMetadata
+    PaperMetadata,
+    PaperStatusResponse
 )
 from ..services.pdf_parser import PDFParser
-from ..services.chunker import TextChunker
+from ..services.chunker import Chunk, TextChunker, get_chunker
+from ..services.vector_store import (
+    UPSERT_BATCH_SIZE,
+    UPSERT_TOKEN_BUDGET,
+    batch_by_length,
+    estimate_tokens
+)
+from ..services.paper_store import (
+    PROCESSING_TIMEOUT,
+    STATUS_FAILED,
+    STATUS_PROCESSING,
+    STATUS_READY,
+    get_paper_store
+)
 
 router = APIRouter()
 
@@ -25,20 +39,41 @@ router = APIRouter()
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
-# Paper metadata storage (simple JSON file)
-METADATA_FILE = UPLOAD_DIR / "papers_metadata.json"
+# Block size used when copying uploads to disk
+UPLOAD_COPY_BUFSIZE = 1024 * 1024
 
+# Largest accepted upload
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
 
-def load_papers_metadata() -> dict:
-    """Load paper metadata from JSON file"""
-    if METADATA_FILE.exists():
-        return json.loads(METADATA_FILE.read_text())
-    return {}
+# Every PDF starts with this header
+PDF_MAGIC = b"%PDF-"
 
 
-def save_papers_metadata(metadata: dict):
-    """Save paper metadata to JSON file"""
-    METADATA_FILE.write_text(json.dumps(metadata, indent=2, default=str))
+def _upload_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)"
+    )
+
+
+def _save_upload(file: UploadFile, file_path: Path, head: bytes = b""):
+    """
+    Copy an uploaded file to disk block by block instead of reading it whole
+    
+    Args:
+        file: Uploaded file, positioned after head
+        file_path: Destination path
+        head: Bytes already read from the start of the file
+    """
+    written = len(head)
+    with file_path.open("wb") as out:
+        out.write(head)
+        while block := file.file.read(UPLOAD_COPY_BUFSIZE):
+            # Content-Length is optional, so enforce the limit here too
+            written += len(block)
+            if written > MAX_UPLOAD_BYTES:
+                raise _upload_too_large()
+            out.write(block)
 
 
 def get_vector_store():
@@ -47,23 +82,174 @@ def get_vector_store():
     return vector_store
 
 
-@router.post("/upload_paper", response_model=PaperUploadResponse)
+# Max number of chunk batches being embedded/upserted at the same time
+UPSERT_CONCURRENCY = 8
+
+
+async def _produce_chunk_batches(chunker: TextChunker, sections: List[dict], paper_id: str, queue: asyncio.Queue):
+    """Chunk sections in a worker thread, pushing one batch per section onto the queue"""
+    batches = chunker.iter_chunks(sections, paper_id)
+    try:
+        while True:
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
+            await queue.put(batch)
+    finally:
+        # Always signal the consumer, even if chunking failed
+        await queue.put(None)
+
+
+async def _consume_chunk_batches(vs, queue: asyncio.Queue) -> int:
+    """
+    Regroup chunks from the queue into length-sorted batches and upsert
+    them with bounded concurrency
+    """
+    semaphore = asyncio.Semaphore(UPSERT_CONCURRENCY)
+    tasks = []
+    pending = []
+    pending_tokens = 0
+    total_chunks = 0
+    
+    async def upsert(batch: List[Chunk]):
+        try:
+            await vs.upsert_chunks(batch)
+        finally:
+            semaphore.release()
+    
+    async def dispatch(batches: List[List[Chunk]]):
+        for batch in batches:
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(upsert(batch)))
+    
+    try:
+        while (section_chunks := await queue.get()) is not None:
+            pending.extend(section_chunks)
+            pending_tokens += sum(estimate_tokens(chunk.text) for chunk in section_chunks)
+            total_chunks += len(section_chunks)
+            
+            if len(pending) < UPSERT_BATCH_SIZE and pending_tokens < UPSERT_TOKEN_BUDGET:
+                continue
+            
+            # Send all but the last batch, which may still be filled up
+            *ready, pending = batch_by_length(pending)
+            pending_tokens = sum(estimate_tokens(chunk.text) for chunk in pending)
+            await dispatch(ready)
+        
+        await dispatch(batch_by_length(pending))
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Stop the other upserts and wait for them to unwind, so none
+        # land after the caller has deleted the paper's vectors
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    
+    return total_chunks
+
+
+async def ingest_sections(vs, sections: List[dict], paper_id: str) -> int:
+    """
+    Chunk, embed and store a parsed paper
+    
+    Chunking runs off the event loop and feeds the vector store as
+    sections are ready, so embedding overlaps with chunking.
+    
+    Returns:
+        Number of chunks stored
+    """
+    queue = asyncio.Queue()
+    producer = asyncio.create_task(
+        _produce_chunk_batches(get_chunker(), sections, paper_id, queue)
+    )
+    
+    try:
+        total_chunks = await _consume_chunk_batches(vs, queue)
+    except BaseException:
+        producer.cancel()
+        raise
+    
+    # Surface chunking errors
+    await producer
+    
+    await vs.save_paper_index(paper_id)
+    return total_chunks
+
+
+async def process_paper(paper_id: str, file_path: Path):
+    """
+    Parse, chunk and embed an uploaded paper, recording the outcome
+    in the paper store
+    
+    Runs as a background task after /upload_paper has responded.
+    """
+    paper_store = get_paper_store()
+    vs = get_vector_store()
+    
+    try:
+        # Parse PDF (CPU-bound, page ranges are parsed in worker processes)
+        parser = PDFParser()
+        sections, title, total_pages = await parser.extract_text_by_section_parallel(str(file_path))
+        
+        if not sections:
+            raise ValueError("Could not extract text from PDF")
+        
+        # Chunk the document and upsert chunks as they are produced
+        total_chunks = await ingest_sections(vs, sections, paper_id)
+        
+        if not total_chunks:
+            raise ValueError("Document too short to process")
+        
+        await paper_store.update_paper(
+            paper_id,
+            title=title,
+            total_pages=total_pages,
+            total_chunks=total_chunks,
+            status=STATUS_READY
+        )
+        print(f"✅ Processed paper {paper_id}: {total_chunks} chunks")
+        
+    except Exception as e:
+        print(f"❌ Failed to process paper {paper_id}: {e}")
+        
+        # Drop any vectors stored before the failure, and the file
+        try:
+            await vs.delete_paper(paper_id)
+        except Exception:
+            pass
+        await asyncio.to_thread(file_path.unlink, missing_ok=True)
+        
+        await paper_store.update_paper(paper_id, status=STATUS_FAILED, error=str(e))
+
+
+@router.post("/upload_paper", response_model=PaperUploadResponse, status_code=202)
 async def upload_paper(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...)
 ):
     """
     Upload a research paper PDF
     
-    The paper will be:
-    1. Saved to disk
-    2. Parsed to extract text and sections
-    3. Chunked into smaller pieces
-    4. Embedded and stored in vector database
+    The paper is saved to disk and the request returns right away
+    (202 Accepted). In the background the paper will be:
+    1. Parsed to extract text and sections
+    2. Chunked into smaller pieces
+    3. Embedded and stored in vector database
+    
+    Poll GET /paper/{paper_id}/status until it is "ready" or "failed".
     """
-    # Validate file type
+    # Validate file type (name, size, and content header)
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are accepted")
     
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise _upload_too_large()
+    
+    head = await file.read(1024)
+    if not head.startswith(PDF_MAGIC):
+        raise HTTPException(status_code=400, detail="File is not a valid PDF")
+    
     # Generate unique paper ID
     paper_id = str(uuid.uuid4())[:8]
     
@@ -71,60 +257,30 @@ async def upload_paper(
     file_path = UPLOAD_DIR / f"{paper_id}_{file.filename}"
     
     try:
-        content = await file.read()
-        file_path.write_bytes(content)
+        await asyncio.to_thread(_save_upload, file, file_path, head)
     except Exception as e:
+        await asyncio.to_thread(file_path.unlink, missing_ok=True)
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
     
-    try:
-        # Parse PDF
-        parser = PDFParser()
-        sections, title, total_pages = parser.extract_text_by_section(str(file_path))
-        
-        if not sections:
-            raise HTTPException(status_code=400, detail="Could not extract text from PDF")
-        
-        # Chunk the document
-        chunker = TextChunker()
-        chunks = chunker.chunk_document(sections, paper_id)
-        
-        if not chunks:
-            raise HTTPException(status_code=400, detail="Document too short to process")
-        
-        # Get vector store and upsert chunks
-        vs = get_vector_store()
-        await vs.upsert_chunks(chunks)
-        
-        # Save paper metadata
-        metadata = load_papers_metadata()
-        metadata[paper_id] = {
-            "paper_id": paper_id,
-            "filename": file.filename,
-            "title": title,
-            "upload_date": datetime.now().isoformat(),
-            "total_pages": total_pages,
-            "total_chunks": len(chunks),
-            "file_path": str(file_path)
-        }
-        save_papers_metadata(metadata)
-        
-        return PaperUploadResponse(
-            success=True,
-            paper_id=paper_id,
-            filename=file.filename,
-            message=f"Successfully processed paper: {title}",
-            total_chunks=len(chunks),
-            total_pages=total_pages
-        )
-        
-    except HTTPException:
-        # Re-raise HTTP exceptions
-        raise
-    except Exception as e:
-        # Clean up file on error
-        if file_path.exists():
-            file_path.unlink()
-        raise HTTPException(status_code=500, detail=f"Failed to process PDF: {str(e)}")
+    # Record the paper as processing, then hand it to the background task
+    await get_paper_store().add_paper({
+        "paper_id": paper_id,
+        "filename": file.filename,
+        "upload_date": datetime.now().isoformat(),
+        "file_path": str(file_path),
+        "status": STATUS_PROCESSING
+    })
+    background_tasks.add_task(process_paper, paper_id, file_path)
+    
+    return PaperUploadResponse(
+        success=True,
+        paper_id=paper_id,
+        filename=file.filename,
+        message=f"Processing paper: {file.filename}",
+        status=STATUS_PROCESSING
+    )
 
 
 @router.get("/list_papers", response_model=PaperListResponse)
@@ -132,23 +288,22 @@ async def list_papers():
     """
     List all uploaded papers
     """
-    metadata = load_papers_metadata()
+    rows = await get_paper_store().list_papers()
     
+    # Rows come back sorted by upload date (newest first)
     papers = [
         PaperMetadata(
             paper_id=data["paper_id"],
             filename=data["filename"],
-            title=data.get("title"),
+            title=data["title"],
             upload_date=datetime.fromisoformat(data["upload_date"]),
-            total_pages=data.get("total_pages", 0),
-            total_chunks=data.get("total_chunks", 0)
+            total_pages=data["total_pages"] or 0,
+            total_chunks=data["total_chunks"] or 0,
+            status=data["status"]
         )
-        for data in metadata.values()
+        for data in rows
     ]
     
-    # Sort by upload date (newest first)
-    papers.sort(key=lambda p: p.upload_date, reverse=True)
-    
     return PaperListResponse(
         papers=papers,
         total=len(papers)
@@ -160,31 +315,28 @@ async def delete_paper(paper_id: str):
     """
     Delete a paper and its vectors from the database
     """
-    metadata = load_papers_metadata()
+    paper_store = get_paper_store()
+    paper_data = await paper_store.get_paper(paper_id)
     
-    if paper_id not in metadata:
+    if not paper_data:
         raise HTTPException(status_code=404, detail="Paper not found")
     
-    paper_data = metadata[paper_id]
-    
     try:
         # Delete from vector store
         vs = get_vector_store()
         await vs.delete_paper(paper_id)
         
         # Delete file from disk
-        file_path = Path(paper_data.get("file_path", ""))
-        if file_path.exists():
-            file_path.unlink()
+        if paper_data["file_path"]:
+            await asyncio.to_thread(Path(paper_data["file_path"]).unlink, missing_ok=True)
         
         # Remove from metadata
-        del metadata[paper_id]
-        save_papers_metadata(metadata)
-        
+        await paper_store.delete_paper(paper_id)
+                
         return PaperDeleteResponse(
             success=True,
             paper_id=paper_id,
-            message=f"Successfully deleted paper: {paper_data.get('title', paper_id)}"
+            message=f"Successfully deleted paper: {paper_data['title'] or paper_id}"
         )
         
     except Exception as e:
@@ -196,9 +348,35 @@ async def get_paper(paper_id: str):
     """
     Get details of a specific paper
     """
-    metadata = load_papers_metadata()
+    paper_data = await get_paper_store().get_paper(paper_id)
+    
+    if not paper_data:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    
+    return paper_data
+
+
+@router.get("/paper/{paper_id}/status", response_model=PaperStatusResponse)
+async def get_paper_status(paper_id: str):
+    """
+    Get the processing status of an uploaded paper
+    """
+    paper_store = get_paper_store()
+    paper_data = await paper_store.get_paper(paper_id)
     
-    if paper_id not in metadata:
+    if not paper_data:
         raise HTTPException(status_code=404, detail="Paper not found")
     
-    return metadata[paper_id]
+    # The process ingesting it may have stopped; don't report "processing" forever
+    started = datetime.fromisoformat(paper_data["upload_date"])
+    if paper_data["status"] == STATUS_PROCESSING and datetime.now() - started > PROCESSING_TIMEOUT:
+        await paper_store.fail_stale_papers()
+        paper_data = await paper_store.get_paper(paper_id) or paper_data
+    
+    return PaperStatusResponse(
+        paper_id=paper_id,
+        status=paper_data["status"],
+        error=paper_data["error"],
+        total_chunks=paper_data["total_chunks"] or 0,
+        total_pages=paper_data["total_pages"] or 0
+    )
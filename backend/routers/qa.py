@@ -2,11 +2,17 @@
 Q&A Router
 Endpoints for asking questions about research papers
 """
-from typing import List
+import json
+from typing import List, Optional
 from fastapi import APIRouter, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 
 from ..models.schemas import QuestionRequest, AnswerResponse
 from ..services.rag_pipeline import RAGPipeline
+from ..services.answer_cache import get_answer_cache
+from ..services.paper_store import get_paper_store
+from ..services.group_service import get_group_service
 
 router = APIRouter()
 
@@ -17,6 +23,50 @@ def get_vector_store():
     return vector_store
 
 
+async def _resolve_group_papers(group_id: Optional[str]) -> Optional[List[str]]:
+    """Get the paper IDs of a group, or None when no group was requested"""
+    if not group_id:
+        return None
+    
+    group = await get_group_service().get_group(group_id)
+    
+    if not group:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Group {group_id} not found"
+        )
+    
+    if not group.paper_ids:
+        raise HTTPException(
+            status_code=400,
+            detail="Group has no papers. Please add papers to the group first."
+        )
+    
+    return group.paper_ids
+
+
+async def _answer_scope(request: QuestionRequest, paper_ids: Optional[List[str]]) -> tuple:
+    """
+    Answer cache scope for a question
+    
+    Includes the paper store revision, so cached answers are dropped when
+    any server process adds or deletes a paper.
+    """
+    return (
+        await get_paper_store().revision(),
+        request.paper_id,
+        tuple(sorted(paper_ids)) if paper_ids else None,
+        request.mode,
+        request.top_k
+    )
+
+
+def _sse_event(data: dict, event: Optional[str] = None) -> str:
+    """Format a Server-Sent Events frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
 @router.post("/ask_question", response_model=AnswerResponse)
 async def ask_question(request: QuestionRequest):
     """
@@ -39,33 +89,25 @@ async def ask_question(request: QuestionRequest):
         rag = RAGPipeline(vs)
         
         # If group_id is provided, get papers from group
-        paper_ids = None
-        if request.group_id:
-            from ..services.group_service import get_group_service
-            group_service = get_group_service()
-            group = await group_service.get_group(request.group_id)
-            
-            if not group:
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"Group {request.group_id} not found"
-                )
-            
-            paper_ids = group.paper_ids
-            if not paper_ids:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Group has no papers. Please add papers to the group first."
-                )
+        paper_ids = await _resolve_group_papers(request.group_id)
         
-        # Get answer
-        result = await rag.answer_question(
-            question=request.question,
-            paper_id=request.paper_id,
-            paper_ids=paper_ids,  # Use paper_ids from group, not group_id
-            mode=request.mode,
-            top_k=request.top_k
-        )
+        # Reuse the answer to the same question over the same papers
+        answer_cache = get_answer_cache()
+        scope = await _answer_scope(request, paper_ids)
+        result = answer_cache.get(scope, request.question)
+        
+        if result is not None:
+            result = {**result, "question": request.question}
+        else:
+            # Get answer
+            result = await rag.answer_question(
+                question=request.question,
+                paper_id=request.paper_id,
+                paper_ids=paper_ids,  # Use paper_ids from group, not group_id
+                mode=request.mode,
+                top_k=request.top_k
+            )
+            answer_cache.put(scope, request.question, result)
         
         return AnswerResponse(
             answer=result["answer"],
@@ -84,6 +126,68 @@ async def ask_question(request: QuestionRequest):
         )
 
 
+@router.post("/ask_question_stream")
+async def ask_question_stream(request: QuestionRequest):
+    """
+    Ask a question and stream the answer as Server-Sent Events
+    
+    Accepts the same request as /ask_question. Emits:
+    - data: {"token": "..."} frames as the answer is generated
+    - a final "event: citations" frame with {"citations": [...], "retrieved_chunks": n}
+    - an "event: error" frame with {"detail": "..."} if generation fails midway
+    """
+    vs = get_vector_store()
+    rag = RAGPipeline(vs)
+    
+    paper_ids = await _resolve_group_papers(request.group_id)
+    
+    answer_cache = get_answer_cache()
+    scope = await _answer_scope(request, paper_ids)
+    cached = answer_cache.get(scope, request.question)
+    
+    async def replay_cached():
+        yield {"token": cached["answer"]}
+        yield {"citations": cached["citations"], "retrieved_chunks": cached["retrieved_chunks"]}
+    
+    async def event_stream():
+        if cached is not None:
+            events = replay_cached()
+        else:
+            events = rag.answer_question_stream(
+                question=request.question,
+                paper_id=request.paper_id,
+                paper_ids=paper_ids,
+                mode=request.mode,
+                top_k=request.top_k
+            )
+        
+        answer_parts = []
+        try:
+            async for event in events:
+                if "token" in event:
+                    answer_parts.append(event["token"])
+                    yield _sse_event({"token": event["token"]})
+                else:
+                    final = event
+        except Exception as e:
+            print(f"ERROR in ask_question_stream: {e}")
+            yield _sse_event({"detail": f"Failed to generate answer: {str(e)}"}, event="error")
+            return
+        
+        if cached is None:
+            answer_cache.put(scope, request.question, {
+                "answer": "".join(answer_parts),
+                "citations": final["citations"],
+                "question": request.question,
+                "mode": request.mode,
+                "retrieved_chunks": final["retrieved_chunks"]
+            })
+        
+        yield _sse_event(final, event="citations")
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @router.post("/compare_papers")
 async def compare_papers(
     question: str,
@@ -0,0 +1,68 @@
+"""
+Answer Cache Service
+Cache of generated answers keyed by normalized question text
+"""
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+# Set ANSWER_CACHE=false to always generate a fresh answer
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "true").lower() == "true"
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+class AnswerCache:
+    """
+    Cache answers for questions that were already asked
+    
+    Entries are keyed by scope (paper store revision, which papers were
+    searched, response mode, top_k) and the normalized question, so a
+    repeat that differs only in case, whitespace or a trailing "?" is
+    answered without embedding, retrieval or generation. The least
+    recently used entries are evicted first.
+    """
+    
+    def __init__(self, max_entries: int = 4096, enabled: bool = ANSWER_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._answers: "OrderedDict[Tuple[Tuple, str], Dict]" = OrderedDict()
+    
+    def get(self, scope: Tuple, question: str) -> Optional[Dict]:
+        """Return the cached answer to the same question in this scope, if any"""
+        if not self.enabled:
+            return None
+        
+        key = (scope, normalize_question(question))
+        answer = self._answers.get(key)
+        if answer is not None:
+            self._answers.move_to_end(key)
+        return answer
+    
+    def put(self, scope: Tuple, question: str, answer: Dict):
+        """Cache an answer, evicting the least recently used entries when full"""
+        if not self.enabled:
+            return
+        
+        key = (scope, normalize_question(question))
+        self._answers[key] = answer
+        self._answers.move_to_end(key)
+        
+        while len(self._answers) > self.max_entries:
+            self._answers.popitem(last=False)
+
+
+# Singleton instance
+_answer_cache = None
+
+
+def get_answer_cache() -> AnswerCache:
+    """Get or create answer cache singleton"""
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache()
+    return _answer_cache
@@ -0,0 +1,298 @@
+"""
+Binary Index Service
+Local 1-bit shadow of the vector store for fast first-stage retrieval
+"""
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .chunker import Chunk
+
+
+# Bits set in each byte value, for Hamming distance over packed codes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Hamming-search candidates kept per requested result, before exact rerank
+RERANK_OVERSAMPLE = 4
+
+# A sync lock untouched for this long is assumed to be left by a crashed process
+SYNC_LOCK_TIMEOUT = 120
+
+
+def pack_binary(vectors: np.ndarray) -> np.ndarray:
+    """Quantize vectors to 1 bit per dimension (the sign), packed 8 per byte"""
+    return np.packbits(vectors > 0, axis=-1)
+
+
+@dataclass
+class PaperShard:
+    """Binary codes, rerank vectors and metadata for one paper's chunks"""
+    codes: np.ndarray  # (n, dim / 8) uint8
+    vectors: np.ndarray  # (n, dim) float16, L2-normalized
+    chunk_ids: List[str]
+    metadata: List[Dict]  # {section, page, text} per chunk
+    
+    def sorted_by_chunk_id(self) -> "PaperShard":
+        """
+        Same shard with rows in chunk ID order
+        
+        Rows are appended in whatever order upserts finish, or Pinecone
+        returns them when mirrored; a fixed order makes searches return
+        the same results in every process.
+        """
+        order = sorted(range(len(self.chunk_ids)), key=self.chunk_ids.__getitem__)
+        return PaperShard(
+            codes=self.codes[order],
+            vectors=self.vectors[order],
+            chunk_ids=[self.chunk_ids[row] for row in order],
+            metadata=[self.metadata[row] for row in order]
+        )
+
+
+class BinaryIndex:
+    """
+    In-memory binary index of chunk embeddings, one shard per paper
+    
+    Queries scan the 1-bit codes by Hamming distance (XOR + popcount),
+    then rerank the best RERANK_OVERSAMPLE * top_k candidates by exact
+    cosine similarity against locally stored float16 vectors. Nothing
+    goes over the network.
+    
+    Shards are saved to one file per paper. Other server processes pick
+    up new or deleted files when the directory changes.
+    """
+    
+    def __init__(self, index_dir: str = "uploads/binary_index"):
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self._shards: Dict[str, PaperShard] = {}
+        self._unsaved = set()  # Papers still being ingested by this process
+        self._dir_mtime = None
+        self._lock = threading.Lock()
+        # Outside index_dir, so taking it doesn't make other processes rescan
+        self._sync_lock_path = self.index_dir.with_name(f"{self.index_dir.name}.sync.lock")
+        # Whether every stored paper has a shard (see VectorStore.sync_local_index);
+        # until then only queries naming specific papers are answered locally
+        self.complete = False
+    
+    def _shard_path(self, paper_id: str) -> Path:
+        return self.index_dir / f"{paper_id}.npz"
+    
+    def add(self, chunks: List[Chunk], embeddings: np.ndarray):
+        """Add embedded chunks to their papers' shards (in memory until save)"""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        codes = pack_binary(vectors)
+        vectors = vectors.astype(np.float16)
+        
+        rows_by_paper: Dict[str, List[int]] = {}
+        for row, chunk in enumerate(chunks):
+            rows_by_paper.setdefault(chunk.paper_id, []).append(row)
+        
+        with self._lock:
+            for paper_id, rows in rows_by_paper.items():
+                added = PaperShard(
+                    codes=codes[rows],
+                    vectors=vectors[rows],
+                    chunk_ids=[chunks[row].chunk_id for row in rows],
+                    metadata=[
+                        {
+                            "section": chunks[row].section,
+                            "page": chunks[row].page,
+                            "text": chunks[row].text[:1000]
+                        }
+                        for row in rows
+                    ]
+                )
+                
+                shard = self._shards.get(paper_id)
+                if shard is not None:
+                    added = PaperShard(
+                        codes=np.concatenate([shard.codes, added.codes]),
+                        vectors=np.concatenate([shard.vectors, added.vectors]),
+                        chunk_ids=shard.chunk_ids + added.chunk_ids,
+                        metadata=shard.metadata + added.metadata
+                    )
+                
+                self._shards[paper_id] = added.sorted_by_chunk_id()
+                self._unsaved.add(paper_id)
+    
+    def save(self, paper_id: str):
+        """Write a paper's shard to disk so other processes can load it"""
+        with self._lock:
+            shard = self._shards.get(paper_id)
+            self._unsaved.discard(paper_id)
+        
+        if shard is None:
+            return
+        
+        # Write to a temporary file first so readers never see a partial shard;
+        # the name is per process, as two processes may save the same paper
+        path = self._shard_path(paper_id)
+        tmp_path = path.with_name(f"{paper_id}.{os.getpid()}.tmp.npz")
+        np.savez(
+            tmp_path,
+            codes=shard.codes,
+            vectors=shard.vectors,
+            chunk_ids=np.array(shard.chunk_ids),
+            metadata=np.frombuffer(json.dumps(shard.metadata).encode(), dtype=np.uint8)
+        )
+        os.replace(tmp_path, path)
+    
+    def remove(self, paper_id: str):
+        """Drop a paper's shard from memory and disk"""
+        with self._lock:
+            self._shards.pop(paper_id, None)
+            self._unsaved.discard(paper_id)
+        self._shard_path(paper_id).unlink(missing_ok=True)
+    
+    def has_paper(self, paper_id: str) -> bool:
+        """Check whether a paper has a shard (in memory or on disk)"""
+        self._refresh()
+        with self._lock:
+            return paper_id in self._shards
+    
+    def _refresh(self):
+        """Load shards added, and drop shards deleted, by other processes"""
+        mtime = self.index_dir.stat().st_mtime_ns
+        if mtime == self._dir_mtime:
+            return
+        
+        on_disk = {
+            path.stem: path
+            for path in self.index_dir.glob("*.npz")
+            if not path.name.endswith(".tmp.npz")
+        }
+        
+        with self._lock:
+            for paper_id in list(self._shards):
+                if paper_id not in on_disk and paper_id not in self._unsaved:
+                    del self._shards[paper_id]
+            missing = [paper_id for paper_id in on_disk if paper_id not in self._shards]
+        
+        for paper_id in missing:
+            try:
+                with np.load(on_disk[paper_id]) as data:
+                    shard = PaperShard(
+                        codes=data["codes"],
+                        vectors=data["vectors"],
+                        chunk_ids=data["chunk_ids"].tolist(),
+                        metadata=json.loads(data["metadata"].tobytes())
+                    ).sorted_by_chunk_id()
+            except Exception as e:
+                # Deleted meanwhile, or unreadable: leave it for sync to re-mirror
+                print(f"⚠️ Skipping local index shard {paper_id}: {e}")
+                continue
+            with self._lock:
+                self._shards.setdefault(paper_id, shard)
+        
+        self._dir_mtime = mtime
+    
+    def acquire_sync_lock(self) -> bool:
+        """
+        Try to become the one process that mirrors papers into the index
+        
+        Returns:
+            True if this process holds the lock and should sync
+        """
+        try:
+            open(self._sync_lock_path, 'x').close()
+            return True
+        except FileExistsError:
+            pass
+        
+        try:
+            idle = time.time() - self._sync_lock_path.stat().st_mtime
+        except FileNotFoundError:
+            return False  # Just released; the caller checks again later
+        if idle > SYNC_LOCK_TIMEOUT:
+            self._sync_lock_path.unlink(missing_ok=True)
+        return False
+    
+    def touch_sync_lock(self):
+        """Show other processes that the sync is still making progress"""
+        os.utime(self._sync_lock_path)
+    
+    def release_sync_lock(self):
+        """Let other processes sync again"""
+        self._sync_lock_path.unlink(missing_ok=True)
+    
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int = 5,
+        paper_ids: Optional[List[str]] = None
+    ) -> Optional[List[Dict]]:
+        """
+        Search chunks, optionally only those of the given papers
+        
+        Returns:
+            List of {chunk_id, score, text, section, page, paper_id}, or
+            None if the index can't answer (a requested paper isn't indexed
+            locally, or all papers were asked for before the index is complete)
+        """
+        self._refresh()
+        
+        # Shards are searched in paper ID order (and rows are in chunk ID
+        # order), so ties break the same way in every process
+        with self._lock:
+            if paper_ids:
+                shards = [(paper_id, self._shards.get(paper_id)) for paper_id in sorted(set(paper_ids))]
+                if any(shard is None for _, shard in shards):
+                    return None
+            elif self.complete:
+                shards = sorted(self._shards.items())
+            else:
+                return None
+        
+        if not shards:
+            return None
+        
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_code = pack_binary(query)
+        
+        # Stage 1: Hamming distance over the packed codes of every shard
+        distances = np.concatenate([
+            _POPCOUNT[shard.codes ^ query_code].sum(axis=1, dtype=np.int32)
+            for _, shard in shards
+        ])
+        offsets = np.cumsum([0] + [len(shard.chunk_ids) for _, shard in shards])
+        
+        # Keep everything closer than the n-th distance, then fill up with
+        # ties at that distance in position order (argpartition alone picks
+        # among ties arbitrarily)
+        n_candidates = min(top_k * RERANK_OVERSAMPLE, len(distances))
+        cutoff = np.partition(distances, n_candidates - 1)[n_candidates - 1]
+        closer = np.flatnonzero(distances < cutoff)
+        ties = np.flatnonzero(distances == cutoff)[:n_candidates - len(closer)]
+        candidates = np.sort(np.concatenate([closer, ties]))
+        
+        # Stage 2: exact cosine similarity on the candidates
+        locations = []
+        for position in candidates:
+            shard_index = int(np.searchsorted(offsets, position, side="right")) - 1
+            locations.append((shard_index, int(position - offsets[shard_index])))
+        
+        candidate_vectors = np.stack([shards[s][1].vectors[row] for s, row in locations])
+        scores = candidate_vectors.astype(np.float32) @ query
+        
+        results = []
+        for best in np.argsort(-scores, kind="stable")[:top_k]:
+            shard_index, row = locations[best]
+            paper_id, shard = shards[shard_index]
+            metadata = shard.metadata[row]
+            results.append({
+                "chunk_id": shard.chunk_ids[row],
+                "score": float(scores[best]),
+                "text": metadata["text"],
+                "section": metadata["section"],
+                "page": metadata["page"],
+                "paper_id": paper_id
+            })
+        
+        return results
@@ -2,10 +2,48 @@
 Text Chunking Service
 Splits text into semantic chunks with overlap for RAG
 """
+import bisect
 import tiktoken
-from typing import List, Dict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Dict, Iterator, Tuple
 import re
 
+try:
+    import blingfire  # Finite-state sentence splitter (C++), much faster than regex
+except ImportError:
+    blingfire = None
+
+
+# Whitespace runs, collapsed to a single space before sentence splitting
+_WS_RE = re.compile(r'\s+')
+
+# Sentence boundary: whitespace after . ! or ? followed by a capital letter
+# (fallback when blingfire isn't installed)
+_SENT_RE = re.compile(r'(?<=[.!?])\s+(?=[A-Z])')
+
+
+@dataclass
+class Chunk:
+    """
+    A piece of a paper's text, ready to be embedded
+    
+    Slotted: a paper can produce thousands of these during ingestion.
+    """
+    __slots__ = ("chunk_id", "paper_id", "section", "page", "text")
+    
+    chunk_id: str
+    paper_id: str
+    section: str
+    page: int
+    text: str
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(name: str) -> tiktoken.Encoding:
+    """Load a tiktoken encoding once per process"""
+    return tiktoken.get_encoding(name)
+
 
 class TextChunker:
     """
@@ -25,17 +63,17 @@ class TextChunker:
     ):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.tokenizer = tiktoken.get_encoding(model)
+        self.tokenizer = _get_encoding(model)
     
     def count_tokens(self, text: str) -> int:
         """Count tokens in text"""
-        return len(self.tokenizer.encode(text))
+        return len(self.tokenizer.encode_ordinary(text))
     
     def chunk_document(
         self,
         sections: List[Dict],
         paper_id: str
-    ) -> List[Dict]:
+    ) -> List[Chunk]:
         """
         Chunk a document that's been parsed into sections
         
@@ -46,7 +84,23 @@ class TextChunker:
         Returns:
             List of chunks with metadata
         """
-        chunks = []
+        return [
+            chunk
+            for section_chunks in self.iter_chunks(sections, paper_id)
+            for chunk in section_chunks
+        ]
+    
+    def iter_chunks(
+        self,
+        sections: List[Dict],
+        paper_id: str
+    ) -> Iterator[List[Chunk]]:
+        """
+        Lazily chunk a document, yielding one batch of chunks per section
+        
+        Chunk IDs are numbered across the whole document, exactly as
+        in chunk_document, so batches can be stored as they are produced.
+        """
         chunk_id = 0
         
         for section_data in sections:
@@ -59,19 +113,19 @@ class TextChunker:
                 continue
             
             # Chunk this section's text
-            section_chunks = self._chunk_text(text, section_name, page)
-            
-            for chunk_text in section_chunks:
-                chunks.append({
-                    "chunk_id": f"{paper_id}_chunk_{chunk_id}",
-                    "paper_id": paper_id,
-                    "section": section_name,
-                    "page": page,
-                    "text": chunk_text
-                })
+            section_chunks = []
+            for chunk_text in self._chunk_text(text, section_name, page):
+                section_chunks.append(Chunk(
+                    chunk_id=f"{paper_id}_chunk_{chunk_id}",
+                    paper_id=paper_id,
+                    section=section_name,
+                    page=page,
+                    text=chunk_text
+                ))
                 chunk_id += 1
-        
-        return chunks
+            
+            if section_chunks:
+                yield section_chunks
     
     def _chunk_text(
         self,
@@ -85,46 +139,34 @@ class TextChunker:
         Tries to split on sentence boundaries when possible
         """
         # If text is small enough, return as single chunk
-        if self.count_tokens(text) <= self.chunk_size:
+        if len(self.tokenizer.encode_ordinary(text)) <= self.chunk_size:
             return [text.strip()] if text.strip() else []
         
-        # Split into sentences
+        # Split into sentences and count tokens for all of them in one batched call
         sentences = self._split_sentences(text)
+        sentence_counts = [len(ids) for ids in self.tokenizer.encode_ordinary_batch(sentences)]
         
         chunks = []
         current_chunk = []
+        current_counts = []  # Token count of each sentence in current_chunk
         current_tokens = 0
         
-        for sentence in sentences:
-            sentence_tokens = self.count_tokens(sentence)
-            
+        for sentence, sentence_tokens in zip(sentences, sentence_counts):
             # If single sentence is too long, split it
             if sentence_tokens > self.chunk_size:
                 # Save current chunk if not empty
                 if current_chunk:
                     chunks.append(' '.join(current_chunk))
-                    current_chunk = []
-                    current_tokens = 0
-                
-                # Split long sentence by words
-                words = sentence.split()
-                temp_chunk = []
-                temp_tokens = 0
                 
-                for word in words:
-                    word_tokens = self.count_tokens(word + ' ')
-                    if temp_tokens + word_tokens > self.chunk_size:
-                        if temp_chunk:
-                            chunks.append(' '.join(temp_chunk))
-                        temp_chunk = [word]
-                        temp_tokens = word_tokens
-                    else:
-                        temp_chunk.append(word)
-                        temp_tokens += word_tokens
+                # Split long sentence into chunk_size token windows
+                pieces = self._split_long_sentence(sentence)
+                chunks.extend(piece for piece, _ in pieces[:-1])
                 
-                if temp_chunk:
-                    current_chunk = temp_chunk
-                    current_tokens = temp_tokens
+                # The remainder starts the next chunk
+                last_text, last_tokens = pieces[-1]
+                current_chunk = [last_text]
+                current_counts = [last_tokens]
+                current_tokens = last_tokens
                 continue
             
             # Check if adding sentence exceeds chunk size
@@ -134,11 +176,13 @@ class TextChunker:
                     chunks.append(' '.join(current_chunk))
                 
                 # Start new chunk with overlap
-                overlap_text = self._get_overlap(current_chunk)
-                current_chunk = overlap_text + [sentence]
-                current_tokens = self.count_tokens(' '.join(current_chunk))
+                overlap, overlap_tokens = self._get_overlap(current_chunk, current_counts)
+                current_chunk = overlap + [sentence]
+                current_counts = current_counts[len(current_counts) - len(overlap):] + [sentence_tokens]
+                current_tokens = overlap_tokens + sentence_tokens
             else:
                 current_chunk.append(sentence)
+                current_counts.append(sentence_tokens)
                 current_tokens += sentence_tokens
         
         # Don't forget the last chunk
@@ -147,31 +191,80 @@ class TextChunker:
         
         return chunks
     
+    def _split_long_sentence(self, sentence: str) -> List[Tuple[str, int]]:
+        """
+        Split a sentence longer than chunk_size into (text, token_count) windows
+        
+        Windows are cut on character offsets, backed up to the last space
+        when there is one, so neither words nor characters that span
+        several byte tokens (math symbols, Greek, CJK) are cut in half.
+        """
+        ids = self.tokenizer.encode_ordinary(sentence)
+        # offsets[i] is the character where token i starts; a token holding
+        # the tail of a multi-byte character points at that character's start
+        _, offsets = self.tokenizer.decode_with_offsets(ids)
+        
+        texts = []
+        start = 0  # Character offset of the current window
+        first_token = 0
+        while len(ids) - first_token > self.chunk_size:
+            # At least one character, even if chunk_size is under one character's tokens
+            end = max(offsets[first_token + self.chunk_size], start + 1)
+            space = sentence.rfind(' ', start + 1, end + 1)
+            if space > start:
+                end = space
+            texts.append(sentence[start:end])
+            start = end
+            first_token = bisect.bisect_left(offsets, end)
+        texts.append(sentence[start:])
+        
+        texts = [text.strip() for text in texts if text.strip()]
+        counts = [len(window) for window in self.tokenizer.encode_ordinary_batch(texts)]
+        return list(zip(texts, counts))
+    
     def _split_sentences(self, text: str) -> List[str]:
         """Split text into sentences"""
         # Simple sentence splitting on period, question mark, exclamation
         # Preserves abbreviations like "e.g.", "i.e.", "et al."
-        text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
+        text = _WS_RE.sub(' ', text)  # Normalize whitespace
         
         # Split on sentence boundaries
-        sentences = re.split(r'(?<=[.!?])\s+(?=[A-Z])', text)
+        if blingfire is not None:
+            sentences = blingfire.text_to_sentences(text).split('\n')
+        else:
+            sentences = _SENT_RE.split(text)
         
         return [s.strip() for s in sentences if s.strip()]
     
-    def _get_overlap(self, chunk: List[str]) -> List[str]:
-        """Get overlap sentences from end of chunk"""
+    def _get_overlap(self, chunk: List[str], counts: List[int]) -> Tuple[List[str], int]:
+        """
+        Get overlap sentences from end of chunk using their cached token counts
+        
+        Returns:
+            (overlap sentences, their total token count)
+        """
         if not chunk:
-            return []
+            return [], 0
         
         overlap = []
         tokens = 0
         
         # Work backwards through sentences
-        for sentence in reversed(chunk):
-            sentence_tokens = self.count_tokens(sentence)
+        for sentence, sentence_tokens in zip(reversed(chunk), reversed(counts)):
             if tokens + sentence_tokens > self.chunk_overlap:
                 break
-            overlap.insert(0, sentence)
+            overlap.append(sentence)
             tokens += sentence_tokens
         
-        return overlap
+        overlap.reverse()
+        return overlap, tokens
+
+
+@lru_cache(maxsize=None)
+def get_chunker(
+    chunk_size: int = 600,
+    chunk_overlap: int = 100,
+    model: str = "cl100k_base"
+) -> TextChunker:
+    """Get a shared chunker for the given settings (chunkers are stateless)"""
+    return TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap, model=model)
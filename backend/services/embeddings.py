@@ -3,9 +3,114 @@ Embedding Service
 Generates vector embeddings for text chunks using BGE
 """
 import os
-from typing import List
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+import numpy as np
+import torch
+from diskcache import Cache
 from sentence_transformers import SentenceTransformer
 
+try:
+    # Optional ONNX Runtime backend (EMBEDDING_BACKEND=onnx)
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+except ImportError:
+    ORTModelForFeatureExtraction = None
+
+try:
+    # Optional fused attention for transformers versions without native SDPA
+    from optimum.bettertransformer import BetterTransformer
+except ImportError:
+    BetterTransformer = None
+
+
+# Where exported, int8-quantized ONNX models are cached
+ONNX_CACHE_DIR = os.getenv("EMBEDDING_ONNX_DIR", "models/onnx")
+
+# On-disk cache of chunk embeddings, keyed by a hash of the chunk text
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "uploads/embed_cache")
+
+# Query embeddings kept for repeated questions
+QUERY_CACHE_SIZE = 1024
+
+# Texts per shard below which a batch isn't split across embedding workers
+EMBED_SHARD_MIN_TEXTS = 32
+
+
+class OnnxEncoder:
+    """
+    BGE encoder exported to ONNX and dynamically quantized to int8
+    
+    Runs the transformer through onnxruntime instead of PyTorch eager,
+    which fuses the encoder layers and uses int8 GEMM kernels on CPU.
+    Embeddings use CLS pooling, the same as BGE's sentence-transformers config.
+    """
+    
+    device = None  # CPU only
+    
+    def __init__(self, model_name: str, cache_dir: str = ONNX_CACHE_DIR, max_length: int = 512):
+        self.max_length = max_length
+        model_dir = Path(cache_dir) / model_name.replace("/", "__")
+        
+        # Export and quantize once, then reuse the cached file
+        if not (model_dir / "model_quantized.onnx").exists():
+            print(f"📦 Exporting {model_name} to ONNX (int8)")
+            exported = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            quantizer = ORTQuantizer.from_pretrained(exported)
+            quantizer.quantize(
+                save_dir=model_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            )
+            exported.config.save_pretrained(model_dir)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+        
+        model = ORTModelForFeatureExtraction.from_pretrained(model_dir, file_name="model_quantized.onnx")
+        self.session = model.model
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        self.hidden_size = model.config.hidden_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.hidden_size
+    
+    def encode(
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        normalize_embeddings: bool = True,
+        **kwargs
+    ) -> np.ndarray:
+        """Embed texts, returning an array of shape (len(texts), dimension)"""
+        # Batch texts of similar length together so batches pad less,
+        # then restore the input order
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        sorted_texts = [texts[i] for i in order]
+        
+        batches = []
+        for start in range(0, len(sorted_texts), batch_size):
+            inputs = self.tokenizer(
+                sorted_texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np"
+            )
+            feed = {name: inputs[name].astype(np.int64) for name in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+            batches.append(hidden[:, 0])  # CLS token
+        
+        embeddings = np.empty((len(texts), self.hidden_size), dtype=np.float32)
+        embeddings[order] = np.concatenate(batches)
+        if normalize_embeddings:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+
 
 class EmbeddingService:
     """
@@ -15,25 +120,192 @@ class EmbeddingService:
     excellent performance for RAG applications.
     """
     
-    def __init__(self, model_name: str = None):
+    def __init__(self, model_name: str = None, workers: Optional[int] = None):
         self.model_name = model_name or os.getenv("EMBEDDING_MODEL", "BAAI/bge-base-en-v1.5")
+        self.backend = os.getenv("EMBEDDING_BACKEND", "torch")  # torch or onnx
+        # Keep only the leading dimensions of each embedding (0 = all)
+        self.output_dim = int(os.getenv("EMBEDDING_DIM", "0"))
         self._model = None
+        self._model_lock = threading.Lock()
+        
+        # Worker processes for embed_texts (0 = embed in this process).
+        # Each worker loads its own copy of the model.
+        self.workers = int(os.getenv("EMBEDDING_WORKERS", "0")) if workers is None else workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        
+        self._query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        
+        # Shared by all server processes; identical chunks (re-uploads,
+        # boilerplate) are embedded once
+        self._cache = None
     
     @property
-    def model(self) -> SentenceTransformer:
-        """Lazy load the model"""
+    def model(self):
+        """Lazy load the model (a SentenceTransformer or OnnxEncoder)"""
         if self._model is None:
-            print(f"📦 Loading embedding model: {self.model_name}")
-            self._model = SentenceTransformer(self.model_name)
-            print(f"✅ Embedding model loaded (dim={self._model.get_sentence_embedding_dimension()})")
+            # Embeddings may be requested from several worker threads at once
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._load_model()
+                    print(f"✅ Embedding model loaded (dim={self._model.get_sentence_embedding_dimension()})")
         return self._model
     
+    def _load_model(self):
+        """Load the encoder for the configured backend"""
+        if self.backend == "onnx":
+            if ORTModelForFeatureExtraction is not None:
+                print(f"📦 Loading embedding model: {self.model_name} (ONNX int8)")
+                return OnnxEncoder(self.model_name)
+            print("⚠️ optimum[onnxruntime] is not installed, falling back to PyTorch")
+        
+        print(f"📦 Loading embedding model: {self.model_name}")
+        return self._accelerate(SentenceTransformer(self.model_name))
+    
+    def _accelerate(self, model: SentenceTransformer) -> SentenceTransformer:
+        """
+        Run the transformer with fused attention, and compile it when
+        EMBEDDING_COMPILE=true. Steps this machine can't run are skipped.
+        """
+        transformer = model._first_module()
+        
+        # Recent transformers already run BERT attention through SDPA
+        attention = getattr(transformer.auto_model.config, "_attn_implementation", None)
+        if attention != "sdpa" and BetterTransformer is not None:
+            try:
+                transformer.auto_model = BetterTransformer.transform(transformer.auto_model)
+                print("⚡ Using fused attention (BetterTransformer)")
+            except Exception as e:
+                print(f"⚠️ Fused attention unavailable, using eager attention: {e}")
+        
+        if os.getenv("EMBEDDING_COMPILE", "false").lower() == "true":
+            eager_model = transformer.auto_model
+            try:
+                transformer.auto_model = torch.compile(eager_model, mode="reduce-overhead", dynamic=True)
+                # Compilation happens on the first call, so fail here rather than mid-request
+                model.encode(["warmup"], normalize_embeddings=True)
+                print("⚡ Embedding model compiled")
+            except Exception as e:
+                transformer.auto_model = eager_model
+                print(f"⚠️ torch.compile failed, running the model eagerly: {e}")
+        
+        return model
+    
+    @property
+    def batch_size(self) -> int:
+        """Default encode batch size, tuned for the device the model runs on"""
+        configured = os.getenv("EMBEDDING_BATCH_SIZE")
+        if configured:
+            return int(configured)
+        device = self.model.device
+        return 256 if device is not None and device.type == "cuda" else 64
+    
+    @property
+    def uncased(self) -> bool:
+        """Whether the model's tokenizer lowercases its input"""
+        tokenizer = getattr(self.model, "tokenizer", None)
+        return bool(getattr(tokenizer, "do_lower_case", False))
+    
     @property
     def dimension(self) -> int:
-        """Get embedding dimension"""
-        return self.model.get_sentence_embedding_dimension()
+        """Get embedding dimension (after truncation to output_dim)"""
+        full_dim = self.model.get_sentence_embedding_dimension()
+        return min(self.output_dim, full_dim) if self.output_dim else full_dim
     
-    def embed_text(self, text: str) -> List[float]:
+    def _truncate(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Keep the leading output_dim dimensions and renormalize
+        
+        Matryoshka-style truncation: shorter vectors cost proportionally
+        less to store and compare, at a small loss in retrieval quality.
+        """
+        if not self.output_dim or self.output_dim >= embeddings.shape[-1]:
+            return embeddings
+        embeddings = embeddings[..., :self.output_dim]
+        return embeddings / np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    
+    def _encode(self, texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+        """
+        Embed texts with the loaded backend, returning normalized vectors
+        
+        Both backends batch texts by length to minimize padding.
+        """
+        return self.model.encode(
+            texts,
+            batch_size=batch_size or self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=len(texts) > 10
+        )
+    
+    @property
+    def cache(self) -> Cache:
+        """Lazy open the on-disk embedding cache"""
+        if self._cache is None:
+            self._cache = Cache(EMBEDDING_CACHE_DIR)
+        return self._cache
+    
+    def _cache_key(self, text: str) -> str:
+        """Cache key for a text, scoped to the model that embeds it"""
+        digest = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+        return f"{self.backend}:{self.model_name}:{digest}"
+    
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Lazy start the embedding worker processes"""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    # spawn: forking a process that already runs threads isn't safe
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+        return self._executor
+    
+    def _encode_in_workers(self, texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+        """
+        Embed texts in the worker processes
+        
+        Large batches are split into shards, one per worker. Shards take
+        every n-th text in length order, so each gets a similar mix of
+        short and long texts.
+        """
+        n_shards = max(1, min(self.workers, len(texts) // EMBED_SHARD_MIN_TEXTS))
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        shards = [order[i::n_shards] for i in range(n_shards)]
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        
+        futures = [
+            self.executor.submit(
+                _worker_embed,
+                [texts[i] for i in shard],
+                self.model_name,
+                batch_size,
+                threads
+            )
+            for shard in shards
+        ]
+        
+        embeddings = None
+        for shard, future in zip(shards, futures):
+            result = future.result()
+            if embeddings is None:
+                embeddings = np.empty((len(texts), result.shape[1]), dtype=result.dtype)
+            embeddings[shard] = result
+        return embeddings
+    
+    def shutdown(self):
+        """Stop the embedding worker processes and close the cache"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+    
+    def embed_text(self, text: str) -> np.ndarray:
         """
         Generate embedding for a single text
         
@@ -41,43 +313,90 @@ class EmbeddingService:
             text: Text to embed
             
         Returns:
-            List of floats (embedding vector)
+            float32 array of shape (dimension,)
         """
-        # BGE models work better with query prefix for queries
-        embedding = self.model.encode(text, normalize_embeddings=True)
-        return embedding.tolist()
+        return self._truncate(self._encode([text], batch_size=1)[0])
     
-    def embed_texts(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+    def embed_texts(self, texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
         """
         Generate embeddings for multiple texts
         
+        Texts embedded before (by any paper) are read from the on-disk
+        cache; only the rest go through the model.
+        
         Args:
             texts: List of texts to embed
-            batch_size: Batch size for processing
+            batch_size: Batch size for processing (defaults to self.batch_size)
             
         Returns:
-            List of embedding vectors
+            float32 array of shape (len(texts), dimension)
         """
         if not texts:
-            return []
+            return np.empty((0, self.dimension), dtype=np.float32)
         
-        embeddings = self.model.encode(
-            texts,
-            batch_size=batch_size,
-            normalize_embeddings=True,
-            show_progress_bar=len(texts) > 10
-        )
-        return embeddings.tolist()
+        keys = [self._cache_key(text) for text in texts]
+        embeddings = [self.cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            if self.workers > 0:
+                encoded = self._encode_in_workers(missing_texts, batch_size=batch_size)
+            else:
+                encoded = self._encode(missing_texts, batch_size=batch_size)
+            
+            # One transaction for the whole batch instead of one per text
+            with self.cache.transact():
+                for i, embedding in zip(missing, encoded):
+                    self.cache.set(keys[i], embedding)
+                    embeddings[i] = embedding
+        
+        # The cache holds full vectors, so EMBEDDING_DIM can change without clearing it
+        return self._truncate(np.stack(embeddings))
     
-    def embed_query(self, query: str) -> List[float]:
+    def embed_query(self, query: str) -> np.ndarray:
         """
         Generate embedding for a query
         
-        For BGE models, queries should be prefixed for better retrieval
+        For BGE models, queries should be prefixed for better retrieval.
+        Embeddings are cached by the whitespace-collapsed query, also
+        lowercased when the tokenizer is uncased (it then sees both the
+        same way).
         """
+        key = " ".join(query.split())
+        if self.uncased:
+            key = key.lower()
+        with self._query_cache_lock:
+            cached = self._query_cache.get(key)
+            if cached is not None:
+                self._query_cache.move_to_end(key)
+                return cached
+        
         # BGE instruction prefix for queries
         query_with_instruction = f"Represent this sentence for searching relevant passages: {query}"
-        return self.embed_text(query_with_instruction)
+        embedding = self.embed_text(query_with_instruction)
+        # Shared between callers through the cache, so make it read-only
+        embedding.flags.writeable = False
+        
+        with self._query_cache_lock:
+            self._query_cache[key] = embedding
+            while len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return embedding
+
+
+# Embedding service of a worker process
+_worker_service = None
+
+
+def _worker_embed(texts: List[str], model_name: str, batch_size: Optional[int], threads: int) -> np.ndarray:
+    """Embed texts in a worker process, loading the model on first use"""
+    global _worker_service
+    if _worker_service is None:
+        # Split the cores between workers instead of every worker using all of them
+        torch.set_num_threads(threads)
+        _worker_service = EmbeddingService(model_name, workers=0)
+    return _worker_service._encode(texts, batch_size=batch_size)
 
 
 # Singleton instance
@@ -3,58 +3,176 @@ Group Service
 Manages paper groups for multi-document queries
 """
 import os
-import json
+import time
 import uuid
-from typing import List, Optional
+import asyncio
+import threading
+from typing import Dict, List, Optional
 from datetime import datetime
 from pathlib import Path
 
+import orjson
+
 from ..models.schemas import PaperGroup, GroupCreate, GroupUpdate
 
 
+# Log entries after which the log is folded into the snapshot file
+COMPACT_AFTER = 1000
+
+# A compaction lock older than this is assumed to be left by a crashed process
+COMPACT_LOCK_TIMEOUT = 60
+
+
 class GroupService:
     """
     Service for managing paper groups
-    Uses simple JSON file storage for group metadata
+    
+    Groups are served from an in-memory dict. Changes are appended to a
+    JSON-lines log next to the JSON snapshot file, one line per change,
+    instead of rewriting every group. Before each operation the service
+    replays lines other server processes appended, so all workers agree.
+    The log is periodically compacted into the snapshot.
     """
     
     def __init__(self, storage_path: str = "data/groups.json"):
-        self.storage_path = storage_path
-        self._ensure_storage()
+        self.storage_path = Path(storage_path)
+        self.log_path = self.storage_path.with_suffix(".log")
+        self._compacting_path = self.storage_path.with_suffix(".log.compacting")
+        self._lock_path = self.storage_path.with_suffix(".compact.lock")
+        self._groups: Dict[str, dict] = {}
+        self._log_entries = 0
+        self._log_offset = 0
+        self._version = None  # (snapshot mtime, log inode) the groups were loaded from
+        self._write_lock = asyncio.Lock()
+        self._sync_lock = threading.Lock()
+        self.storage_path.parent.mkdir(parents=True, exist_ok=True)
+        self._sync()
     
-    def _ensure_storage(self):
-        """Create storage directory and file if they don't exist"""
-        storage_dir = Path(self.storage_path).parent
-        storage_dir.mkdir(parents=True, exist_ok=True)
+    @staticmethod
+    def _apply(groups: Dict[str, dict], entry: dict):
+        """Apply one log entry to a groups dict"""
+        if entry["op"] == "put":
+            groups[entry["group"]["group_id"]] = entry["group"]
+        elif entry["op"] == "del":
+            groups.pop(entry["group_id"], None)
+    
+    def _load_snapshot(self) -> Dict[str, dict]:
+        """Load groups from the JSON snapshot file"""
+        try:
+            return {g["group_id"]: g for g in orjson.loads(self.storage_path.read_bytes())}
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            return {}
+    
+    def _replay(self, groups: Dict[str, dict], path: Path, offset: int = 0) -> int:
+        """
+        Apply the complete log lines after offset to groups
+        
+        Returns:
+            Offset just past the last complete line
+        """
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return offset
+        
+        # A trailing partial line is still being written; read it next time
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                self._apply(groups, orjson.loads(line))
+                self._log_entries += 1
+        return offset + end
+    
+    def _sync(self):
+        """
+        Bring the in-memory groups up to date with the files on disk
+        
+        Runs in worker threads. Changes are applied to a copy that then
+        replaces self._groups, so readers on the event loop never see a
+        dict being modified.
+        """
+        with self._sync_lock:
+            self._sync_locked()
+    
+    def _sync_locked(self):
+        try:
+            snapshot_mtime = self.storage_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            snapshot_mtime = None
+        try:
+            log_stat = self.log_path.stat()
+        except FileNotFoundError:
+            log_stat = None
+        
+        version = (snapshot_mtime, log_stat.st_ino if log_stat else None)
         
-        if not os.path.exists(self.storage_path):
-            self._save_groups([])
+        if version != self._version:
+            # First load, or another process compacted: reload everything
+            groups = self._load_snapshot()
+            self._log_entries = 0
+            self._replay(groups, self._compacting_path)
+            self._log_offset = self._replay(groups, self.log_path)
+            self._groups = groups
+            self._version = version
+        elif log_stat is not None and log_stat.st_size > self._log_offset:
+            groups = dict(self._groups)
+            self._log_offset = self._replay(groups, self.log_path, self._log_offset)
+            self._groups = groups
     
-    def _load_groups(self) -> List[dict]:
-        """Load groups from JSON file"""
+    def _append(self, entry: dict):
+        """Append one change to the log"""
+        with open(self.log_path, 'ab') as f:
+            f.write(orjson.dumps(entry) + b"\n")
+    
+    def _compact(self):
+        """Fold the log into the snapshot file (one process at a time)"""
+        lock = None
+        for _ in range(2):
+            try:
+                lock = open(self._lock_path, 'x')
+                break
+            except FileExistsError:
+                pass
+            
+            try:
+                idle = time.time() - self._lock_path.stat().st_mtime
+            except FileNotFoundError:
+                continue  # Just released; try to take it again
+            if idle > COMPACT_LOCK_TIMEOUT:
+                self._lock_path.unlink(missing_ok=True)
+            return  # Another process is compacting
+        if lock is None:
+            return
+        
         try:
-            with open(self.storage_path, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
-    
-    def _save_groups(self, groups: List[dict]):
-        """Save groups to JSON file"""
-        with open(self.storage_path, 'w') as f:
-            json.dump(groups, f, indent=2, default=str)
-    
-    def _find_group_index(self, group_id: str) -> Optional[int]:
-        """Find index of group by ID"""
-        groups = self._load_groups()
-        for i, group in enumerate(groups):
-            if group.get('group_id') == group_id:
-                return i
-        return None
+            # New changes go to a fresh log while this one is folded in
+            if self.log_path.exists():
+                os.replace(self.log_path, self._compacting_path)
+            
+            groups = self._load_snapshot()
+            self._replay(groups, self._compacting_path)
+            
+            tmp_path = self.storage_path.with_suffix(".json.tmp")
+            tmp_path.write_bytes(orjson.dumps(list(groups.values()), option=orjson.OPT_INDENT_2))
+            os.replace(tmp_path, self.storage_path)
+            
+            self._compacting_path.unlink(missing_ok=True)
+        finally:
+            lock.close()
+            self._lock_path.unlink(missing_ok=True)
+    
+    async def _commit(self, entry: dict):
+        """Persist a change and apply it (caller holds the write lock)"""
+        await asyncio.to_thread(self._append, entry)
+        await asyncio.to_thread(self._sync)
+        
+        if self._log_entries >= COMPACT_AFTER:
+            await asyncio.to_thread(self._compact)
     
     async def create_group(self, group_data: GroupCreate) -> PaperGroup:
         """Create a new paper group"""
-        groups = self._load_groups()
-        
         # Generate unique ID
         group_id = str(uuid.uuid4())
         
@@ -67,63 +185,72 @@ class GroupService:
             "created_date": datetime.now().isoformat()
         }
         
-        groups.append(new_group)
-        self._save_groups(groups)
+        async with self._write_lock:
+            await self._commit({"op": "put", "group": new_group})
         
         return PaperGroup(**new_group)
     
     async def get_all_groups(self) -> List[PaperGroup]:
         """Get all groups"""
-        groups = self._load_groups()
-        return [PaperGroup(**g) for g in groups]
+        await asyncio.to_thread(self._sync)
+        return [PaperGroup(**g) for g in self._groups.values()]
     
     async def get_group(self, group_id: str) -> Optional[PaperGroup]:
         """Get a specific group by ID"""
-        idx = self._find_group_index(group_id)
-        if idx is None:
+        await asyncio.to_thread(self._sync)
+        group = self._groups.get(group_id)
+        if group is None:
             return None
         
-        groups = self._load_groups()
-        return PaperGroup(**groups[idx])
+        return PaperGroup(**group)
+    
+    async def get_groups_by_ids(self, group_ids: List[str]) -> List[PaperGroup]:
+        """Get several groups, skipping unknown IDs"""
+        await asyncio.to_thread(self._sync)
+        return [
+            PaperGroup(**self._groups[group_id])
+            for group_id in group_ids
+            if group_id in self._groups
+        ]
     
     async def update_group(self, group_id: str, updates: GroupUpdate) -> Optional[PaperGroup]:
         """Update a group"""
-        idx = self._find_group_index(group_id)
-        if idx is None:
-            return None
-        
-        groups = self._load_groups()
-        group = groups[idx]
-        
-        # Update basic fields
-        if updates.name is not None:
-            group['name'] = updates.name
-        if updates.description is not None:
-            group['description'] = updates.description
-        
-        # Handle paper additions/removals
-        paper_ids = set(group.get('paper_ids', []))
+        async with self._write_lock:
+            await asyncio.to_thread(self._sync)
+            if group_id not in self._groups:
+                return None
+            
+            group = dict(self._groups[group_id])
+            
+            # Update basic fields
+            if updates.name is not None:
+                group['name'] = updates.name
+            if updates.description is not None:
+                group['description'] = updates.description
+            
+            # Handle paper additions/removals
+            paper_ids = set(group.get('paper_ids', []))
+            
+            if updates.add_papers:
+                paper_ids.update(updates.add_papers)
+            
+            if updates.remove_papers:
+                paper_ids.difference_update(updates.remove_papers)
+            
+            group['paper_ids'] = list(paper_ids)
+            
+            await self._commit({"op": "put", "group": group})
         
-        if updates.add_papers:
-            paper_ids.update(updates.add_papers)
-        
-        if updates.remove_papers:
-            paper_ids.difference_update(updates.remove_papers)
-        
-        group['paper_ids'] = list(paper_ids)
-        
-        self._save_groups(groups)
         return PaperGroup(**group)
     
     async def delete_group(self, group_id: str) -> bool:
         """Delete a group"""
-        idx = self._find_group_index(group_id)
-        if idx is None:
-            return False
-        
-        groups = self._load_groups()
-        groups.pop(idx)
-        self._save_groups(groups)
+        async with self._write_lock:
+            await asyncio.to_thread(self._sync)
+            if group_id not in self._groups:
+                return False
+            
+            await self._commit({"op": "del", "group_id": group_id})
         
         return True
     
@@ -143,10 +270,10 @@ class GroupService:
     
     async def get_groups_for_paper(self, paper_id: str) -> List[PaperGroup]:
         """Get all groups that contain a specific paper"""
-        groups = self._load_groups()
+        await asyncio.to_thread(self._sync)
         return [
             PaperGroup(**g)
-            for g in groups
+            for g in self._groups.values()
             if paper_id in g.get('paper_ids', [])
         ]
 
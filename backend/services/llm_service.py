@@ -3,8 +3,8 @@ LLM Service
 Handles communication with Groq API for LLaMA inference
 """
 import os
-from typing import Optional
-from groq import Groq
+from typing import AsyncIterator, Optional
+from groq import AsyncGroq
 from ..prompts.templates import SYSTEM_PROMPT, build_prompt
 
 
@@ -23,12 +23,12 @@ class LLMService:
         self.model = "llama-3.3-70b-versatile"
     
     @property
-    def client(self) -> Groq:
-        """Lazy load Groq client"""
+    def client(self) -> AsyncGroq:
+        """Lazy load async Groq client (requests don't block the event loop)"""
         if self._client is None:
             if not self.api_key:
                 raise ValueError("GROQ_API_KEY environment variable not set")
-            self._client = Groq(api_key=self.api_key)
+            self._client = AsyncGroq(api_key=self.api_key)
         return self._client
     
     async def generate_answer(
@@ -42,6 +42,8 @@ class LLMService:
         """
         Generate an answer using RAG context
         
+        Collects the streamed answer (see stream_answer) into one string.
+        
         Args:
             question: User's question
             chunks: Retrieved context chunks from vector store
@@ -52,21 +54,44 @@ class LLMService:
         Returns:
             Generated answer text
         """
-        # Build the prompt with context
+        parts = [
+            token
+            async for token in self.stream_answer(
+                question, chunks, mode, max_tokens=max_tokens, temperature=temperature
+            )
+        ]
+        return "".join(parts)
+    
+    async def stream_answer(
+        self,
+        question: str,
+        chunks: list,
+        mode: str = "academic",
+        max_tokens: int = 1024,
+        temperature: float = 0.3
+    ) -> AsyncIterator[str]:
+        """
+        Generate an answer using RAG context, yielding text as it is produced
+        
+        Takes the same arguments as generate_answer.
+        """
         user_prompt = build_prompt(question, chunks, mode)
         
-        # Call Groq API
-        response = self.client.chat.completions.create(
+        stream = await self.client.chat.completions.create(
             model=self.model,
             messages=[
                 {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
             ],
             max_tokens=max_tokens,
-            temperature=temperature
+            temperature=temperature,
+            stream=True
         )
         
-        return response.choices[0].message.content
+        async for chunk in stream:
+            content = chunk.choices[0].delta.content
+            if content:
+                yield content
     
     async def generate_summary(
         self,
@@ -84,7 +109,7 @@ class LLMService:
 
 Summary:"""
         
-        response = self.client.chat.completions.create(
+        response = await self.client.chat.completions.create(
             model=self.model,
             messages=[
                 {"role": "system", "content": "You are an expert at summarizing academic papers. Be concise but capture key points."},
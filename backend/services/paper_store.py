@@ -0,0 +1,251 @@
+"""
+Paper Store Service
+Persists uploaded paper metadata in SQLite
+"""
+import os
+import json
+import sqlite3
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+
+PAPER_COLUMNS = (
+    "paper_id",
+    "filename",
+    "title",
+    "upload_date",
+    "total_pages",
+    "total_chunks",
+    "file_path",
+    "status",
+    "error"
+)
+
+# Processing states of an uploaded paper
+STATUS_PROCESSING = "processing"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+# Papers still processing after this long were abandoned by a server
+# process that stopped mid-ingest
+PROCESSING_TIMEOUT = timedelta(minutes=int(os.getenv("PROCESSING_TIMEOUT_MINUTES", "30")))
+
+
+class PaperStore:
+    """
+    Service for storing paper metadata
+    
+    Each operation is a single SQL statement run in a worker thread,
+    so requests never block the event loop or rewrite the whole store.
+    
+    A revision counter is bumped on every change so caches in any
+    server process can tell when the set of papers has changed.
+    """
+    
+    def __init__(
+        self,
+        db_path: str = "uploads/papers.db",
+        legacy_json_path: str = "uploads/papers_metadata.json"
+    ):
+        self.db_path = db_path
+        self._ensure_storage(legacy_json_path)
+    
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection that commits on success and always closes"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def _ensure_storage(self, legacy_json_path: str):
+        """Create the database, importing the old JSON metadata file if present"""
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            
+            # Every server process runs this at startup; the write lock makes
+            # them migrate one at a time, so later ones find the work done
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS papers (
+                    paper_id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    title TEXT,
+                    upload_date TEXT NOT NULL,
+                    total_pages INTEGER DEFAULT 0,
+                    total_chunks INTEGER DEFAULT 0,
+                    file_path TEXT,
+                    status TEXT NOT NULL DEFAULT 'ready',
+                    error TEXT
+                )
+                """
+            )
+            
+            # Add columns introduced after the table was first created
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(papers)")}
+            if "status" not in existing:
+                conn.execute("ALTER TABLE papers ADD COLUMN status TEXT NOT NULL DEFAULT 'ready'")
+            if "error" not in existing:
+                conn.execute("ALTER TABLE papers ADD COLUMN error TEXT")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS revision (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    value INTEGER NOT NULL
+                )
+                """
+            )
+            conn.execute("INSERT OR IGNORE INTO revision (id, value) VALUES (0, 0)")
+            
+            # A missing file means there's nothing to import, or another
+            # process already imported it
+            legacy_path = Path(legacy_json_path)
+            try:
+                legacy = json.loads(legacy_path.read_text())
+            except FileNotFoundError:
+                legacy = None
+            
+            if legacy is not None:
+                for paper in legacy.values():
+                    self._insert_row(conn, paper, replace=False)
+                self._bump_revision(conn)
+        
+        # Importing twice is harmless (existing rows are kept), so the file
+        # is only renamed once the rows are committed
+        if legacy is not None:
+            try:
+                legacy_path.rename(legacy_path.with_suffix(".json.migrated"))
+            except FileNotFoundError:
+                pass
+    
+    def _insert(self, paper: Dict, replace: bool = True):
+        """Insert a paper row"""
+        with self._connect() as conn:
+            self._insert_row(conn, paper, replace)
+            self._bump_revision(conn)
+    
+    def _insert_row(self, conn: sqlite3.Connection, paper: Dict, replace: bool):
+        """Insert a paper row inside the caller's transaction"""
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        paper = {"status": STATUS_READY, **paper}
+        placeholders = ", ".join("?" for _ in PAPER_COLUMNS)
+        conn.execute(
+            f"{verb} INTO papers ({', '.join(PAPER_COLUMNS)}) VALUES ({placeholders})",
+            [paper.get(column) for column in PAPER_COLUMNS]
+        )
+    
+    def _update(self, paper_id: str, fields: Dict) -> bool:
+        """Update some columns of a paper row"""
+        unknown = set(fields) - set(PAPER_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown paper columns: {', '.join(sorted(unknown))}")
+        
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE papers SET {assignments} WHERE paper_id = ?",
+                [*fields.values(), paper_id]
+            )
+            self._bump_revision(conn)
+        return cursor.rowcount > 0
+    
+    def _fail_stale(self, cutoff: str) -> int:
+        """Mark papers that started processing before cutoff as failed"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE papers SET status = ?, error = ? WHERE status = ? AND upload_date < ?",
+                (STATUS_FAILED, "Processing was interrupted", STATUS_PROCESSING, cutoff)
+            )
+            if cursor.rowcount:
+                self._bump_revision(conn)
+        return cursor.rowcount
+    
+    def _select_all(self) -> List[Dict]:
+        """Select all papers, newest first"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM papers ORDER BY upload_date DESC"
+            ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def _select(self, paper_id: str) -> Optional[Dict]:
+        """Select a single paper"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM papers WHERE paper_id = ?", (paper_id,)
+            ).fetchone()
+        return dict(row) if row else None
+    
+    def _delete(self, paper_id: str) -> bool:
+        """Delete a single paper"""
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM papers WHERE paper_id = ?", (paper_id,))
+            self._bump_revision(conn)
+        return cursor.rowcount > 0
+    
+    def _bump_revision(self, conn: sqlite3.Connection):
+        """Record that the set of papers changed (inside the caller's transaction)"""
+        conn.execute("UPDATE revision SET value = value + 1 WHERE id = 0")
+    
+    def _select_revision(self) -> int:
+        """Select the current revision"""
+        with self._connect() as conn:
+            return conn.execute("SELECT value FROM revision WHERE id = 0").fetchone()[0]
+    
+    async def add_paper(self, paper: Dict):
+        """Store metadata for a paper"""
+        await asyncio.to_thread(self._insert, paper)
+    
+    async def update_paper(self, paper_id: str, **fields) -> bool:
+        """Update stored metadata for a paper (e.g. its processing status)"""
+        return await asyncio.to_thread(self._update, paper_id, fields)
+    
+    async def fail_stale_papers(self, max_age: timedelta = PROCESSING_TIMEOUT) -> int:
+        """
+        Mark papers stuck in processing for longer than max_age as failed
+        
+        Any server process may be processing a paper, so only papers older
+        than any real ingest can be assumed abandoned.
+        
+        Returns:
+            Number of papers marked failed
+        """
+        cutoff = (datetime.now() - max_age).isoformat()
+        return await asyncio.to_thread(self._fail_stale, cutoff)
+    
+    async def list_papers(self) -> List[Dict]:
+        """Get all papers, newest first"""
+        return await asyncio.to_thread(self._select_all)
+    
+    async def get_paper(self, paper_id: str) -> Optional[Dict]:
+        """Get a specific paper by ID"""
+        return await asyncio.to_thread(self._select, paper_id)
+    
+    async def delete_paper(self, paper_id: str) -> bool:
+        """Delete a paper's metadata"""
+        return await asyncio.to_thread(self._delete, paper_id)
+    
+    async def revision(self) -> int:
+        """Get a counter that changes whenever papers are added or deleted"""
+        return await asyncio.to_thread(self._select_revision)
+
+
+# Singleton instance
+_paper_store = None
+
+
+def get_paper_store() -> PaperStore:
+    """Get or create paper store singleton"""
+    global _paper_store
+    if _paper_store is None:
+        _paper_store = PaperStore()
+    return _paper_store
@@ -3,8 +3,13 @@ PDF Parser Service
 Extracts text from PDFs with section detection and page tracking
 """
 import fitz  # PyMuPDF
+import os
 import re
-from typing import List, Dict, Tuple
+import asyncio
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from pathlib import Path
 
 
@@ -31,11 +36,31 @@ SECTION_PATTERNS = [
 ]
 
 
+def _line_pattern(pattern: str) -> str:
+    """Adapt a SECTION_PATTERNS entry to match inside one line of a page"""
+    pattern = pattern.lstrip('^').replace(r'\s', r'[^\S\n]')
+    if pattern.endswith('$'):
+        # "Nothing else on the line" instead of "end of string"
+        pattern = pattern[:-1] + r'(?=[^\S\n]*$)'
+    return f'(?:{pattern})'
+
+
+# All section patterns in one regex, run over a whole page: matches a
+# line whose text (without surrounding whitespace) starts with a header
+_SECTION_RE = re.compile(
+    r'^[^\S\n]*(?P<name>(?:' + '|'.join(_line_pattern(p) for p in SECTION_PATTERNS) + r')[^\n]*?)[^\S\n]*$',
+    re.IGNORECASE | re.MULTILINE
+)
+
+# Leading section number ("3.", "4 ") stripped from detected headers
+_SECTION_NUMBER_RE = re.compile(r'^\d+\.?\s*')
+
+# Pages parsed by one worker process when a PDF is split into page ranges
+PAGES_PER_TASK = 16
+
+
 class PDFParser:
     """Parse PDF documents and extract structured text"""
-    #converts all section patters to regex objects
-    def __init__(self):
-        self.section_patterns = [re.compile(p, re.IGNORECASE) for p in SECTION_PATTERNS]
     
     def parse(self, pdf_path: str) -> Dict:
         """
@@ -47,38 +72,93 @@ class PDFParser:
                 - total_pages: int
                 - title: str (extracted from first page)
         """
-        doc = fitz.open(pdf_path)
-        pages_data = []
-        title = None
+        parsed = self.parse_page_range(pdf_path)
         
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            text = page.get_text("text")
-            
-            # Extract title from first page (usually largest font)
-            if page_num == 0 and not title:
-                title = self._extract_title(page)
-            
-            # Detect sections in this page
-            sections = self._detect_sections(text)
-            
-            pages_data.append({
-                "page_num": page_num + 1,  # 1-indexed
-                "text": text.strip(),
-                "sections": sections
-            })
+        return {
+            "pages": parsed["pages"],
+            "total_pages": len(parsed["pages"]),
+            "title": parsed["title"] or Path(pdf_path).stem
+        }
+    
+    def page_count(self, pdf_path: str) -> int:
+        """Get the number of pages without extracting any text"""
+        with fitz.open(pdf_path) as doc:
+            return len(doc)
+    
+    def parse_page_range(self, pdf_path: str, start: int = 0, end: Optional[int] = None) -> Dict:
+        """
+        Parse pages [start, end) of a PDF file
         
-        doc.close()
+        Returns:
+            Dict with:
+                - pages: List of (page_num, text, detected_sections)
+                - title: str or None (only set when the range includes the first page)
+        """
+        with fitz.open(pdf_path) as doc:
+            # Extract title from first page (usually largest font)
+            title = None
+            if start == 0 and len(doc) > 0 and (end is None or end > 0):
+                first_page, title = self._parse_first_page(doc)
+                pages_data = [first_page, *self.iter_pages(doc, 1, end)]
+            else:
+                pages_data = list(self.iter_pages(doc, start, end))
         
         return {
             "pages": pages_data,
-            "total_pages": len(pages_data),
-            "title": title or Path(pdf_path).stem
+            "title": title
+        }
+    
+    def iter_pages(self, doc: fitz.Document, start: int = 0, end: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Parse pages [start, end) of an open PDF, one page at a time
+        
+        Only the current page is held in memory, so callers that consume
+        pages as they come never keep the whole document's text around.
+        
+        Yields:
+            Dict with page_num (1-indexed), text, and detected sections
+        """
+        end = len(doc) if end is None else min(end, len(doc))
+        
+        for page_num in range(start, end):
+            page = doc.load_page(page_num)
+            text = page.get_text("text")
+            del page  # Release the page before loading the next one
+            
+            yield self._page_data(page_num, text)
+    
+    def _page_data(self, page_num: int, text: str) -> Dict:
+        """Page dict with page_num (1-indexed), text, and detected sections"""
+        return {
+            "page_num": page_num + 1,  # 1-indexed
+            "text": text.strip(),
+            "sections": self._detect_sections(text)
         }
     
-    def _extract_title(self, page) -> str:
-        """Extract title from first page using font size heuristic"""
+    def _parse_first_page(self, doc: fitz.Document) -> Tuple[Dict, Optional[str]]:
+        """
+        Parse the first page and extract the title from it
+        
+        Both come from one structured ("dict") extraction, instead of
+        running PyMuPDF's layout analysis on the page twice.
+        
+        Returns:
+            (page dict, title or None)
+        """
+        page = doc.load_page(0)
         blocks = page.get_text("dict")["blocks"]
+        del page
+        
+        # Same text as get_text("text"): spans joined per line, one line per row
+        text = "".join(
+            "".join(span["text"] for span in line["spans"]) + "\n"
+            for block in blocks
+            for line in block.get("lines", [])
+        )
+        return self._page_data(0, text), self._extract_title(blocks)
+    
+    def _extract_title(self, blocks: List[Dict]) -> Optional[str]:
+        """Extract title from the first page's text blocks using font size heuristic"""
         title_candidates = []
         
         for block in blocks:
@@ -102,23 +182,18 @@ class PDFParser:
         Detect section headers in text
         
         Returns:
-            List of (char_position, section_name)
+            List of (char_position, section_name), in page order
         """
         sections = []
-        lines = text.split('\n')
-        char_pos = 0
-        
-        for line in lines:
-            stripped = line.strip()
-            if len(stripped) < 50:  # Section headers are usually short
-                for pattern in self.section_patterns:
-                    if pattern.match(stripped):
-                        # Clean up section name
-                        section_name = re.sub(r'^\d+\.?\s*', '', stripped)
-                        section_name = section_name.title()
-                        sections.append((char_pos, section_name))
-                        break
-            char_pos += len(line) + 1  # +1 for newline
+        
+        # One scan over the page instead of trying every pattern on every line
+        for match in _SECTION_RE.finditer(text):
+            header = match.group("name").rstrip()
+            if len(header) < 50:  # Section headers are usually short
+                # Clean up section name
+                section_name = _SECTION_NUMBER_RE.sub('', header, count=1)
+                section_name = section_name.title()
+                sections.append((match.start(), section_name))
         
         return sections
     
@@ -129,13 +204,60 @@ class PDFParser:
         Returns:
             List of dicts with section, text, start_page, end_page
         """
-        parsed = self.parse(pdf_path)
+        with fitz.open(pdf_path) as doc:
+            total_pages = len(doc)
+            title = None
+            pages = iter(())
+            if total_pages:
+                first_page, title = self._parse_first_page(doc)
+                pages = itertools.chain([first_page], self.iter_pages(doc, 1))
+            
+            # Build sections while pages are parsed, without collecting the pages
+            sections = self.build_sections(pages)
+        
+        return sections, title or Path(pdf_path).stem, total_pages
+    
+    async def extract_text_by_section_parallel(self, pdf_path: str) -> List[Dict]:
+        """
+        Same as extract_text_by_section, but parses page ranges of large
+        PDFs concurrently in worker processes
+        """
+        total_pages = await asyncio.to_thread(self.page_count, pdf_path)
+        ranges = [
+            (start, min(start + PAGES_PER_TASK, total_pages))
+            for start in range(0, total_pages, PAGES_PER_TASK)
+        ]
+        
+        # Not worth the inter-process overhead for short papers
+        if len(ranges) <= 1:
+            return await asyncio.to_thread(self.extract_text_by_section, pdf_path)
         
+        loop = asyncio.get_running_loop()
+        executor = get_parse_executor()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(executor, _parse_page_range_task, pdf_path, start, end)
+            for start, end in ranges
+        ])
+        
+        # Ranges come back in page order, so sections spanning a range
+        # boundary are stitched together by build_sections
+        pages = [page for parsed in results for page in parsed["pages"]]
+        title = results[0]["title"] or Path(pdf_path).stem
+        
+        return self.build_sections(pages), title, total_pages
+    
+    def build_sections(self, pages: Iterable[Dict]) -> List[Dict]:
+        """
+        Organize parsed pages by detected sections
+        
+        Returns:
+            List of dicts with section, text, page
+        """
         # Build a flat list of all text with page and section info
         all_chunks = []
         current_section = "Abstract"  # Default starting section
         
-        for page_data in parsed["pages"]:
+        for page_data in pages:
             page_num = page_data["page_num"]
             text = page_data["text"]
             sections = page_data["sections"]
@@ -148,11 +270,10 @@ class PDFParser:
                     "page": page_num
                 })
             else:
-                # Split text by sections
-                sections_sorted = sorted(sections, key=lambda x: x[0])
+                # Split text by sections (already in position order)
                 prev_pos = 0
                 
-                for i, (pos, section_name) in enumerate(sections_sorted):
+                for pos, section_name in sections:
                     # Add text before this section
                     if pos > prev_pos:
                         chunk_text = text[prev_pos:pos].strip()
@@ -176,4 +297,37 @@ class PDFParser:
                             "page": page_num
                         })
         
-        return all_chunks, parsed["title"], parsed["total_pages"]
+        return all_chunks
+
+
+def _parse_page_range_task(pdf_path: str, start: int, end: int) -> Dict:
+    """Parse a page range in a worker process"""
+    return PDFParser().parse_page_range(pdf_path, start, end)
+
+
+# Process pool shared by all uploads
+_parse_executor = None
+
+
+def get_parse_executor() -> ProcessPoolExecutor:
+    """Get or create the PDF parsing process pool"""
+    global _parse_executor
+    if _parse_executor is None:
+        # Every web worker has its own pool, so split the cores between them
+        web_workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+        default_workers = max(1, (os.cpu_count() or 1) // web_workers)
+        max_workers = int(os.getenv("PDF_PARSE_WORKERS", default_workers))
+        # spawn: forking a process that already runs threads isn't safe
+        _parse_executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _parse_executor
+
+
+def shutdown_parse_executor():
+    """Stop the PDF parsing process pool if it was started"""
+    global _parse_executor
+    if _parse_executor is not None:
+        _parse_executor.shutdown()
+        _parse_executor = None
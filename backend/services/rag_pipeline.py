@@ -2,12 +2,23 @@
 RAG Pipeline Service
 Orchestrates retrieval and generation for Q&A
 """
-from typing import List, Dict, Optional
+import asyncio
+from operator import attrgetter
+from typing import AsyncIterator, List, Dict, Optional
+import numpy as np
 from .vector_store import VectorStore
 from .llm_service import get_llm_service
+from .group_service import get_group_service
 from ..models.schemas import Citation
 
 
+# Chunks retrieved per paper when comparing papers
+COMPARE_CHUNKS_PER_PAPER = 3
+
+# Answer returned when retrieval finds nothing
+NO_CONTEXT_ANSWER = "I couldn't find any relevant information in the uploaded papers to answer this question. Please make sure you've uploaded a paper that covers this topic."
+
+
 class RAGPipeline:
     """
     RAG (Retrieval-Augmented Generation) Pipeline
@@ -31,7 +42,8 @@ class RAGPipeline:
         group_id: Optional[str] = None,
         paper_ids: Optional[List[str]] = None,
         mode: str = "academic",
-        top_k: int = 5
+        top_k: int = 5,
+        precomputed_embedding: Optional[np.ndarray] = None
     ) -> Dict:
         """
         Answer a question about research paper(s)
@@ -43,22 +55,19 @@ class RAGPipeline:
             paper_ids: Optional list of papers to search
             mode: Response mode (academic, simple, eli5)
             top_k: Number of chunks to retrieve
+            precomputed_embedding: Optional embedding of the question, skips re-embedding
             
         Returns:
             Dict with answer, citations, and metadata
         """
         # Step 1: Retrieve relevant chunks
-        chunks = await self.vector_store.query(
-            query_text=question,
-            top_k=top_k,
-            paper_id=paper_id,
-            group_id=group_id,
-            paper_ids=paper_ids
+        chunks = await self._retrieve(
+            question, paper_id, group_id, paper_ids, top_k, precomputed_embedding
         )
         
         if not chunks:
             return {
-                "answer": "I couldn't find any relevant information in the uploaded papers to answer this question. Please make sure you've uploaded a paper that covers this topic.",
+                "answer": NO_CONTEXT_ANSWER,
                 "citations": [],
                 "question": question,
                 "mode": mode,
@@ -83,29 +92,92 @@ class RAGPipeline:
             "retrieved_chunks": len(chunks)
         }
     
+    async def answer_question_stream(
+        self,
+        question: str,
+        paper_id: Optional[str] = None,
+        group_id: Optional[str] = None,
+        paper_ids: Optional[List[str]] = None,
+        mode: str = "academic",
+        top_k: int = 5,
+        precomputed_embedding: Optional[np.ndarray] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Answer a question, streaming the answer as it is generated
+        
+        Takes the same arguments as answer_question.
+        
+        Yields:
+            {"token": str} for each piece of the answer, then a final
+            {"citations": List[Citation], "retrieved_chunks": int}
+        """
+        chunks = await self._retrieve(
+            question, paper_id, group_id, paper_ids, top_k, precomputed_embedding
+        )
+        
+        if not chunks:
+            yield {"token": NO_CONTEXT_ANSWER}
+            yield {"citations": [], "retrieved_chunks": 0}
+            return
+        
+        async for token in self.llm_service.stream_answer(
+            question=question,
+            chunks=chunks,
+            mode=mode
+        ):
+            yield {"token": token}
+        
+        yield {
+            "citations": self._build_citations(chunks),
+            "retrieved_chunks": len(chunks)
+        }
+    
+    async def _retrieve(
+        self,
+        question: str,
+        paper_id: Optional[str],
+        group_id: Optional[str],
+        paper_ids: Optional[List[str]],
+        top_k: int,
+        precomputed_embedding: Optional[np.ndarray]
+    ) -> List[Dict]:
+        """Retrieve the chunks most relevant to the question"""
+        # Chunks aren't tagged with groups, so search a group through its
+        # papers; the vector store pre-filters on paper_id
+        if group_id and not paper_id and not paper_ids:
+            group = await get_group_service().get_group(group_id)
+            paper_ids = group.paper_ids if group else []
+            if not paper_ids:
+                return []
+        
+        return await self.vector_store.query(
+            query_text=question,
+            top_k=top_k,
+            paper_id=paper_id,
+            paper_ids=paper_ids,
+            query_embedding=precomputed_embedding
+        )
+    
     def _build_citations(self, chunks: List[Dict]) -> List[Citation]:
         """Extract citations from retrieved chunks"""
-        citations = []
-        seen = set()  # Avoid duplicate citations
+        # One citation per (paper, page, section), keeping the first chunk seen
+        seen: Dict[tuple, Citation] = {}
         
         for chunk in chunks:
-            # Create unique key for deduplication
             key = (chunk["paper_id"], chunk["page"], chunk["section"])
             if key in seen:
                 continue
-            seen.add(key)
             
-            citations.append(Citation(
+            text = chunk["text"]
+            seen[key] = Citation(
                 paper_id=chunk["paper_id"],
                 page=chunk["page"],
                 section=chunk["section"],
-                chunk_preview=chunk["text"][:150] + "..." if len(chunk["text"]) > 150 else chunk["text"]
-            ))
+                chunk_preview=text[:150] + "..." if len(text) > 150 else text
+            )
         
         # Sort by page number
-        citations.sort(key=lambda c: c.page)
-        
-        return citations
+        return sorted(seen.values(), key=attrgetter("page"))
     
     async def compare_papers(
         self,
@@ -118,15 +190,42 @@ class RAGPipeline:
         
         Retrieves chunks from specified papers and asks LLM to compare
         """
-        all_chunks = []
+        query_embedding = await asyncio.to_thread(
+            self.vector_store.embedding_service.embed_query, question
+        )
         
-        for paper_id in paper_ids:
-            chunks = await self.vector_store.query(
-                query_text=question,
-                top_k=3,
-                paper_id=paper_id
-            )
-            all_chunks.extend(chunks)
+        # One search across all papers, then keep the best chunks of each
+        chunks = await self.vector_store.query_by_vector(
+            query_embedding,
+            top_k=COMPARE_CHUNKS_PER_PAPER * len(paper_ids),
+            paper_ids=paper_ids
+        )
+        buckets = {paper_id: [] for paper_id in paper_ids}
+        for chunk in chunks:
+            bucket = buckets.get(chunk["paper_id"])
+            if bucket is not None and len(bucket) < COMPARE_CHUNKS_PER_PAPER:
+                bucket.append(chunk)
+        
+        # Papers crowded out of the shared results get their own searches
+        missing = [paper_id for paper_id, bucket in buckets.items() if not bucket]
+        if missing:
+            results = await asyncio.gather(*[
+                self.vector_store.query_by_vector(
+                    query_embedding,
+                    top_k=COMPARE_CHUNKS_PER_PAPER,
+                    paper_id=paper_id
+                )
+                for paper_id in missing
+            ])
+            for paper_id, result in zip(missing, results):
+                buckets[paper_id] = result
+        
+        # Merge by relevance
+        all_chunks = sorted(
+            (chunk for bucket in buckets.values() for chunk in bucket),
+            key=lambda chunk: chunk["score"],
+            reverse=True
+        )
         
         if not all_chunks:
             return {
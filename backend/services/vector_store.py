@@ -3,9 +3,91 @@ Vector Store Service
 Manages Pinecone vector database for storing and querying embeddings
 """
 import os
-from typing import List, Dict, Optional
+import asyncio
+from typing import List, Dict, Optional, Tuple
+import numpy as np
 from pinecone import Pinecone, ServerlessSpec
 from .embeddings import get_embedding_service
+from .chunker import Chunk
+from .binary_index import BinaryIndex
+
+try:
+    # Optional gRPC transport (pip install "pinecone[grpc]")
+    from pinecone.grpc import PineconeGRPC
+except ImportError:
+    PineconeGRPC = None
+
+
+# Limits for one batch of chunks embedded and upserted together during ingestion
+UPSERT_BATCH_SIZE = 96
+UPSERT_TOKEN_BUDGET = 32768  # ~55 full-size (600 token) chunks
+
+# Vectors per Pinecone upsert request
+PINECONE_BATCH_SIZE = 100
+
+# Talk to Pinecone over gRPC (HTTP/2) instead of REST, when installed
+PINECONE_GRPC = os.getenv("PINECONE_GRPC", "false").lower() == "true"
+
+
+# Precision of chunk vectors sent over REST: "float32", "float16" or "int8".
+# Pinecone stores float32 either way; lower precision only shrinks the
+# JSON payload, and is ignored over gRPC, where floats are fixed-width
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float32")
+
+
+# Answer queries from a local binary index with exact rerank, instead of Pinecone
+BINARY_INDEX_ENABLED = os.getenv("BINARY_INDEX", "false").lower() == "true"
+
+# How often a process waiting for another's local index sync checks on it
+SYNC_POLL_SECONDS = 2
+
+
+def quantize_int8(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Scale each vector so its largest component is 127 and round to integers
+    
+    Returns:
+        (int8 vectors, per-vector scale); vector / scale recovers the original
+    """
+    peak = np.max(np.abs(embeddings), axis=1, keepdims=True)
+    scale = 127.0 / np.maximum(peak, 1e-12)
+    quantized = np.clip(np.round(embeddings * scale), -127, 127).astype(np.int8)
+    return quantized, scale[:, 0]
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4
+
+
+def batch_by_length(
+    chunks: List[Chunk],
+    batch_size: int = UPSERT_BATCH_SIZE,
+    max_tokens: int = UPSERT_TOKEN_BUDGET
+) -> List[List[Chunk]]:
+    """
+    Split chunks into batches of similar text length
+    
+    Chunks of similar length pad less when embedded together. A batch
+    closes when it reaches batch_size chunks or max_tokens estimated tokens.
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+    
+    for chunk in sorted(chunks, key=lambda chunk: len(chunk.text)):
+        tokens = estimate_tokens(chunk.text)
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(chunk)
+        batch_tokens += tokens
+    
+    if batch:
+        batches.append(batch)
+    
+    return batches
 
 
 class VectorStore:
@@ -21,14 +103,22 @@ class VectorStore:
         self.index_name = os.getenv("PINECONE_INDEX", "researchgpt")
         self._pc = None
         self._index = None
+        self._grpc = False
         self.embedding_service = get_embedding_service()
+        self.binary_index = BinaryIndex() if BINARY_INDEX_ENABLED else None
     
     async def initialize(self):
         """Initialize Pinecone connection and ensure index exists"""
         if not self.api_key:
             raise ValueError("PINECONE_API_KEY environment variable not set")
         
-        self._pc = Pinecone(api_key=self.api_key)
+        if PINECONE_GRPC and PineconeGRPC is not None:
+            self._pc = PineconeGRPC(api_key=self.api_key)
+            self._grpc = True
+        else:
+            if PINECONE_GRPC:
+                print("⚠️ pinecone[grpc] is not installed, falling back to REST")
+            self._pc = Pinecone(api_key=self.api_key)
         
         # Check if index exists, create if not
         existing_indexes = [idx.name for idx in self._pc.list_indexes()]
@@ -56,13 +146,19 @@ class VectorStore:
             raise RuntimeError("VectorStore not initialized. Call initialize() first.")
         return self._index
     
-    async def upsert_chunks(self, chunks: List[Dict], group_id: Optional[str] = None) -> int:
+    async def upsert_chunks(
+        self,
+        chunks: List[Chunk],
+        group_id: Optional[str] = None,
+        batch_size: Optional[int] = None
+    ) -> int:
         """
         Store document chunks with their embeddings
         
         Args:
-            chunks: List of {chunk_id, paper_id, section, page, text}
+            chunks: Chunks produced by TextChunker
             group_id: Optional group ID to associate chunks with
+            batch_size: Embedding batch size (defaults to the embedding service's)
             
         Returns:
             Number of vectors upserted
@@ -71,39 +167,71 @@ class VectorStore:
             return 0
         
         # Generate embeddings for all chunks
-        texts = [chunk["text"] for chunk in chunks]
-        embeddings = self.embedding_service.embed_texts(texts)
+        texts = [chunk.text for chunk in chunks]
+        embeddings = await asyncio.to_thread(
+            self.embedding_service.embed_texts,
+            texts,
+            batch_size=batch_size
+        )
         
-        # Prepare vectors for Pinecone
-        vectors = []
-        for chunk, embedding in zip(chunks, embeddings):
-            metadata = {
-                "paper_id": chunk["paper_id"],
-                "section": chunk["section"],
-                "page": chunk["page"],
-                "text": chunk["text"][:1000]  # Pinecone metadata limit
+        # Mirror the full-precision vectors into the local binary index
+        if self.binary_index is not None:
+            self.binary_index.add(chunks, embeddings)
+        
+        # With EMBEDDING_DTYPE=int8, round vectors to an int8 grid. The index
+        # uses cosine similarity, which ignores scale, so the integer-valued
+        # vectors are searched as-is while serializing to a fraction of the size
+        scales = None
+        dtype = "float32" if self._grpc else EMBEDDING_DTYPE
+        if dtype == "int8":
+            quantized, scales = quantize_int8(embeddings)
+            embeddings = quantized.astype(np.float32)
+        elif dtype == "float16":
+            # Half-precision values have shorter decimal forms on the wire
+            embeddings = embeddings.astype(np.float16)
+        
+        # Build the payload column by column: one tolist() over the whole
+        # matrix, then (id, values, metadata) tuples
+        metadatas = [
+            {
+                "paper_id": chunk.paper_id,
+                "section": chunk.section,
+                "page": chunk.page,
+                "text": chunk.text[:1000]  # Pinecone metadata limit
             }
-            
-            # Add group_id if provided
-            if group_id:
+            for chunk in chunks
+        ]
+        
+        # Keep the scale so the original vector can be recovered
+        if scales is not None:
+            for metadata, scale in zip(metadatas, scales.tolist()):
+                metadata["embedding_scale"] = scale
+        
+        # Add group_id if provided
+        if group_id:
+            for metadata in metadatas:
                 metadata["group_id"] = group_id
-            
-            vectors.append({
-                "id": chunk["chunk_id"],
-                "values": embedding,
-                "metadata": metadata
-            })
         
-        # Upsert in batches of 100
-        batch_size = 100
-        total_upserted = 0
+        vectors = list(zip(
+            [chunk.chunk_id for chunk in chunks],
+            embeddings.tolist(),
+            metadatas
+        ))
         
-        for i in range(0, len(vectors), batch_size):
-            batch = vectors[i:i + batch_size]
-            self.index.upsert(vectors=batch)
-            total_upserted += len(batch)
+        # Send the upsert requests concurrently instead of one after another
+        writes = asyncio.gather(*[
+            asyncio.to_thread(self.index.upsert, vectors=vectors[i:i + PINECONE_BATCH_SIZE])
+            for i in range(0, len(vectors), PINECONE_BATCH_SIZE)
+        ])
+        try:
+            await asyncio.shield(writes)
+        except asyncio.CancelledError:
+            # Requests already sent can't be called back; let them finish
+            # so a caller cleaning up after cancelling us sees every write
+            await asyncio.gather(writes, return_exceptions=True)
+            raise
         
-        return total_upserted
+        return len(vectors)
     
     async def query(
         self,
@@ -111,7 +239,8 @@ class VectorStore:
         top_k: int = 5,
         paper_id: Optional[str] = None,
         group_id: Optional[str] = None,
-        paper_ids: Optional[List[str]] = None
+        paper_ids: Optional[List[str]] = None,
+        query_embedding: Optional[np.ndarray] = None
     ) -> List[Dict]:
         """
         Search for relevant chunks
@@ -122,28 +251,55 @@ class VectorStore:
             paper_id: Optional filter by single paper
             group_id: Optional filter by group
             paper_ids: Optional filter by list of papers
+            query_embedding: Optional precomputed embedding of query_text
             
         Returns:
             List of {chunk_id, score, text, section, page, paper_id}
         """
-        # Generate query embedding
-        query_embedding = self.embedding_service.embed_query(query_text)
+        # Generate query embedding unless the caller already has it
+        if query_embedding is None:
+            query_embedding = await asyncio.to_thread(self.embedding_service.embed_query, query_text)
         
-        # Build filter
-        filter_dict = None
-        if paper_id:
-            filter_dict = {"paper_id": {"$eq": paper_id}}
-        elif group_id:
-            filter_dict = {"group_id": {"$eq": group_id}}
-        elif paper_ids:
-            filter_dict = {"paper_id": {"$in": paper_ids}}
-        
-        # Query Pinecone
-        results = self.index.query(
-            vector=query_embedding,
+        return await self.query_by_vector(
+            query_embedding,
+            top_k=top_k,
+            paper_id=paper_id,
+            group_id=group_id,
+            paper_ids=paper_ids
+        )
+    
+    async def query_by_vector(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int = 5,
+        paper_id: Optional[str] = None,
+        group_id: Optional[str] = None,
+        paper_ids: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """
+        Search for chunks relevant to an already embedded query
+        
+        Takes the same filters as query. Returns:
+            List of {chunk_id, score, text, section, page, paper_id}
+        """
+        # Chunks aren't tagged with groups locally, so group filters go to Pinecone
+        if self.binary_index is not None and not group_id:
+            chunks = await asyncio.to_thread(
+                self.binary_index.search,
+                query_embedding,
+                top_k,
+                [paper_id] if paper_id else paper_ids
+            )
+            if chunks is not None:
+                return chunks
+        
+        # Query Pinecone, filtering by metadata server-side
+        results = await asyncio.to_thread(
+            self.index.query,
+            vector=query_embedding.tolist(),
             top_k=top_k,
             include_metadata=True,
-            filter=filter_dict
+            filter=self._build_filter(paper_id, group_id, paper_ids)
         )
         
         # Format results
@@ -160,6 +316,23 @@ class VectorStore:
         
         return chunks
     
+    def _build_filter(
+        self,
+        paper_id: Optional[str] = None,
+        group_id: Optional[str] = None,
+        paper_ids: Optional[List[str]] = None
+    ) -> Optional[Dict]:
+        """Build a Pinecone metadata filter so only matching vectors are searched"""
+        if paper_id:
+            return {"paper_id": {"$eq": paper_id}}
+        if group_id:
+            return {"group_id": {"$eq": group_id}}
+        if paper_ids:
+            if len(paper_ids) == 1:
+                return {"paper_id": {"$eq": paper_ids[0]}}
+            return {"paper_id": {"$in": list(paper_ids)}}
+        return None
+    
     async def delete_paper(self, paper_id: str) -> bool:
         """
         Delete all chunks for a paper
@@ -171,9 +344,88 @@ class VectorStore:
             True if successful
         """
         # Pinecone supports delete by metadata filter
-        self.index.delete(filter={"paper_id": {"$eq": paper_id}})
+        await asyncio.to_thread(self.index.delete, filter={"paper_id": {"$eq": paper_id}})
+        
+        if self.binary_index is not None:
+            await asyncio.to_thread(self.binary_index.remove, paper_id)
         return True
     
+    async def sync_local_index(self, paper_ids: List[str]):
+        """
+        Copy papers missing from the local binary index down from Pinecone
+        
+        Covers papers ingested while the local index was off, so that
+        queries over all papers can be answered locally afterwards.
+        """
+        if self.binary_index is None:
+            return
+        
+        # Every server process starts a sync; one mirrors the missing
+        # papers while the others wait for its shards to appear
+        while True:
+            missing = [
+                paper_id for paper_id in paper_ids
+                if not await asyncio.to_thread(self.binary_index.has_paper, paper_id)
+            ]
+            if not missing:
+                break
+            
+            if not await asyncio.to_thread(self.binary_index.acquire_sync_lock):
+                await asyncio.sleep(SYNC_POLL_SECONDS)
+                continue
+            
+            try:
+                for paper_id in missing:
+                    # Ingested by another process in the meantime
+                    if await asyncio.to_thread(self.binary_index.has_paper, paper_id):
+                        continue
+                    await asyncio.to_thread(self._mirror_paper, paper_id)
+                    await asyncio.to_thread(self.binary_index.touch_sync_lock)
+            finally:
+                await asyncio.to_thread(self.binary_index.release_sync_lock)
+            break
+        
+        self.binary_index.complete = True
+        print(f"✅ Local index covers {len(paper_ids)} papers")
+    
+    def _mirror_paper(self, paper_id: str):
+        """Fetch a paper's vectors and metadata from Pinecone into the local index"""
+        chunk_ids = [
+            getattr(item, "id", item)  # ID strings or ListItems, depending on SDK version
+            for page in self.index.list(prefix=f"{paper_id}_chunk_")
+            for item in page
+        ]
+        
+        chunks = []
+        vectors = []
+        for i in range(0, len(chunk_ids), 100):
+            fetched = self.index.fetch(ids=chunk_ids[i:i + 100])
+            for chunk_id, vector in fetched.vectors.items():
+                metadata = vector.metadata or {}
+                chunks.append(Chunk(
+                    chunk_id=chunk_id,
+                    paper_id=paper_id,
+                    section=metadata.get("section", "Unknown"),
+                    page=int(metadata.get("page", 0)),
+                    text=metadata.get("text", "")
+                ))
+                vectors.append(vector.values)
+        
+        if not chunks:
+            return
+        
+        # Stored values may be int8-grid scaled; the local index wants unit vectors
+        embeddings = np.asarray(vectors, dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        
+        self.binary_index.add(chunks, embeddings)
+        self.binary_index.save(paper_id)
+    
+    async def save_paper_index(self, paper_id: str):
+        """Persist the local binary index for a paper once all its chunks are upserted"""
+        if self.binary_index is not None:
+            await asyncio.to_thread(self.binary_index.save, paper_id)
+    
     async def list_papers(self) -> List[str]:
         """
         List all unique paper IDs in the index
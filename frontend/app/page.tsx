@@ -5,6 +5,10 @@ import { PaperSidebar } from './components/PaperSidebar';
 import { ChatInterface } from './components/ChatInterface';
 import { Header } from './components/Header';
 
+// Poll an uploaded paper's status every 1.5 s, for up to 15 minutes
+const STATUS_POLL_MS = 1500;
+const MAX_STATUS_POLLS = 600;
+
 export interface Paper {
   paper_id: string;
   filename: string;
@@ -12,6 +16,7 @@ export interface Paper {
   upload_date: string;
   total_pages: number;
   total_chunks: number;
+  status?: 'processing' | 'ready' | 'failed';
 }
 
 export interface Message {
@@ -156,6 +161,21 @@ export default function Home() {
         throw new Error(error.detail || 'Upload failed');
       }
 
+      // Processing continues in the background; poll until it finishes
+      const { paper_id } = await res.json();
+      await fetchPapers();
+      for (let attempt = 0; ; attempt++) {
+        if (attempt >= MAX_STATUS_POLLS) {
+          throw new Error('Processing is taking too long, check back later');
+        }
+        await new Promise((resolve) => setTimeout(resolve, STATUS_POLL_MS));
+        const statusRes = await fetch(`${API_BASE}/paper/${paper_id}/status`);
+        if (!statusRes.ok) throw new Error('Failed to get processing status');
+        const status = await statusRes.json();
+        if (status.status === 'ready') break;
+        if (status.status === 'failed') throw new Error(status.error || 'Processing failed');
+      }
+
       await fetchPapers();
       return { success: true };
     } catch (error: any) {
@@ -0,0 +1,46 @@
+"""
+Tests for the answer cache
+"""
+from backend.services.answer_cache import AnswerCache, normalize_question
+
+
+def test_normalize_question():
+    assert normalize_question("  What is  BERT?? ") == "what is bert"
+    assert normalize_question("What is BERT") == normalize_question("what is bert.")
+
+
+def test_hit_ignores_case_whitespace_and_punctuation():
+    cache = AnswerCache()
+    cache.put(("rev1", "all"), "What is attention?", {"answer": "A"})
+    
+    assert cache.get(("rev1", "all"), "what is   attention") == {"answer": "A"}
+    assert cache.get(("rev1", "all"), "What is self-attention?") is None
+
+
+def test_scopes_are_isolated():
+    cache = AnswerCache()
+    cache.put(("rev1", ("paper-a",)), "Summarize", {"answer": "A"})
+    cache.put(("rev1", ("paper-b",)), "Summarize", {"answer": "B"})
+    
+    assert cache.get(("rev1", ("paper-a",)), "Summarize") == {"answer": "A"}
+    assert cache.get(("rev1", ("paper-b",)), "Summarize") == {"answer": "B"}
+    assert cache.get(("rev2", ("paper-a",)), "Summarize") is None
+
+
+def test_least_recently_used_is_evicted():
+    cache = AnswerCache(max_entries=2)
+    cache.put("s", "one", {"answer": 1})
+    cache.put("s", "two", {"answer": 2})
+    cache.get("s", "one")
+    cache.put("s", "three", {"answer": 3})
+    
+    assert cache.get("s", "two") is None
+    assert cache.get("s", "one") == {"answer": 1}
+    assert cache.get("s", "three") == {"answer": 3}
+
+
+def test_disabled_cache_never_hits():
+    cache = AnswerCache(enabled=False)
+    cache.put("s", "question", {"answer": 1})
+    
+    assert cache.get("s", "question") is None
@@ -0,0 +1,63 @@
+"""
+Tests for the log-structured group storage
+"""
+import asyncio
+
+from backend.models.schemas import GroupCreate, GroupUpdate
+from backend.services import group_service
+from backend.services.group_service import GroupService
+
+
+def test_changes_survive_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(group_service, "COMPACT_AFTER", 5)
+    storage_path = str(tmp_path / "groups.json")
+    writer = GroupService(storage_path)
+    reader = GroupService(storage_path)
+    
+    async def run():
+        groups = [await writer.create_group(GroupCreate(name=f"group {i}")) for i in range(8)]
+        await writer.update_group(groups[0].group_id, GroupUpdate(add_papers=["paper-1"]))
+        await writer.delete_group(groups[1].group_id)
+        return groups
+    
+    groups = asyncio.run(run())
+    
+    # The log was folded into the snapshot at least once
+    assert (tmp_path / "groups.json").exists()
+    assert not (tmp_path / "groups.compact.lock").exists()
+    
+    for service in (writer, reader, GroupService(storage_path)):
+        stored = {group.group_id: group for group in asyncio.run(service.get_all_groups())}
+        assert set(stored) == {group.group_id for group in groups} - {groups[1].group_id}
+        assert stored[groups[0].group_id].paper_ids == ["paper-1"]
+
+
+def test_reader_sees_appends_after_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(group_service, "COMPACT_AFTER", 3)
+    storage_path = str(tmp_path / "groups.json")
+    writer = GroupService(storage_path)
+    reader = GroupService(storage_path)
+    
+    async def create(names):
+        return [await writer.create_group(GroupCreate(name=name)) for name in names]
+    
+    asyncio.run(create(["a", "b", "c"]))
+    assert (tmp_path / "groups.json").exists()
+    assert len(asyncio.run(reader.get_all_groups())) == 3
+    
+    # Written to the fresh log that replaced the compacted one
+    asyncio.run(create(["d"]))
+    names = sorted(group.name for group in asyncio.run(reader.get_all_groups()))
+    
+    assert names == ["a", "b", "c", "d"]
+
+
+def test_stale_compaction_lock_is_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(group_service, "COMPACT_LOCK_TIMEOUT", -1)
+    service = GroupService(str(tmp_path / "groups.json"))
+    lock_path = tmp_path / "groups.compact.lock"
+    lock_path.touch()
+    
+    service._compact()
+    
+    assert not lock_path.exists()
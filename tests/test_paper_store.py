@@ -0,0 +1,66 @@
+"""
+Tests for the SQLite paper store
+"""
+import json
+import asyncio
+
+from backend.services.paper_store import STATUS_READY, PaperStore
+
+
+LEGACY_PAPERS = {
+    "paper-1": {
+        "paper_id": "paper-1",
+        "filename": "attention.pdf",
+        "title": "Attention Is All You Need",
+        "upload_date": "2024-01-01T10:00:00",
+        "total_pages": 15,
+        "total_chunks": 42,
+        "file_path": "uploads/paper-1.pdf"
+    },
+    "paper-2": {
+        "paper_id": "paper-2",
+        "filename": "bert.pdf",
+        "title": "BERT",
+        "upload_date": "2024-01-02T10:00:00",
+        "total_pages": 16,
+        "total_chunks": 50,
+        "file_path": "uploads/paper-2.pdf"
+    }
+}
+
+
+def test_migrates_legacy_json(tmp_path):
+    legacy_path = tmp_path / "papers_metadata.json"
+    legacy_path.write_text(json.dumps(LEGACY_PAPERS))
+    
+    store = PaperStore(str(tmp_path / "papers.db"), str(legacy_path))
+    papers = asyncio.run(store.list_papers())
+    
+    assert [paper["paper_id"] for paper in papers] == ["paper-2", "paper-1"]
+    assert papers[1]["title"] == "Attention Is All You Need"
+    assert papers[1]["total_chunks"] == 42
+    assert all(paper["status"] == STATUS_READY for paper in papers)
+    assert not legacy_path.exists()
+    assert (tmp_path / "papers_metadata.json.migrated").exists()
+
+
+def test_migration_keeps_existing_rows(tmp_path):
+    legacy_path = tmp_path / "papers_metadata.json"
+    db_path = str(tmp_path / "papers.db")
+    
+    store = PaperStore(db_path, str(legacy_path))
+    asyncio.run(store.add_paper({**LEGACY_PAPERS["paper-1"], "title": "Newer title"}))
+    
+    # e.g. a process that crashed before renaming the file
+    legacy_path.write_text(json.dumps(LEGACY_PAPERS))
+    store = PaperStore(db_path, str(legacy_path))
+    
+    assert asyncio.run(store.get_paper("paper-1"))["title"] == "Newer title"
+    assert asyncio.run(store.get_paper("paper-2"))["title"] == "BERT"
+
+
+def test_missing_legacy_file_is_treated_as_migrated(tmp_path):
+    store = PaperStore(str(tmp_path / "papers.db"), str(tmp_path / "papers_metadata.json"))
+    
+    assert asyncio.run(store.list_papers()) == []
+    assert asyncio.run(store.revision()) == 0
@@ -0,0 +1,85 @@
+"""
+Tests for the chunk-batch consumer used during ingestion
+"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from backend.routers.papers import _consume_chunk_batches
+from backend.services.chunker import Chunk
+
+
+class FailingVectorStore:
+    """Vector store whose last upsert fails while the others are in flight"""
+    
+    def __init__(self, fail_on: int):
+        self.fail_on = fail_on
+        self.calls = 0
+        self.cancelled = 0
+        self.finished = 0
+    
+    async def upsert_chunks(self, chunks):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upsert failed")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        self.finished += 1
+
+
+class RecordingVectorStore:
+    def __init__(self):
+        self.upserted = []
+    
+    async def upsert_chunks(self, chunks):
+        self.upserted.extend(chunk.chunk_id for chunk in chunks)
+
+
+def make_section(paper_id, start, count):
+    return [
+        Chunk(chunk_id=f"{paper_id}_chunk_{i}", paper_id=paper_id, section="Intro", page=1, text="word " * 20)
+        for i in range(start, start + count)
+    ]
+
+
+async def fill_queue(sections):
+    queue = asyncio.Queue()
+    for section in sections:
+        await queue.put(section)
+    await queue.put(None)
+    return queue
+
+
+def test_consumer_upserts_every_chunk():
+    async def run():
+        vs = RecordingVectorStore()
+        queue = await fill_queue([make_section("p", 0, 150), make_section("p", 150, 60)])
+        total = await _consume_chunk_batches(vs, queue)
+        return total, vs.upserted
+    
+    total, upserted = asyncio.run(run())
+    
+    assert total == 210
+    assert sorted(upserted) == sorted(f"p_chunk_{i}" for i in range(210))
+
+
+def test_consumer_cancels_other_upserts_on_error():
+    async def run():
+        # 200 chunks are sent as three batches; the last one fails
+        vs = FailingVectorStore(fail_on=3)
+        queue = await fill_queue([make_section("p", 0, 200)])
+        with pytest.raises(RuntimeError, match="upsert failed"):
+            await _consume_chunk_batches(vs, queue)
+        return vs
+    
+    vs = asyncio.run(run())
+    
+    assert vs.calls == 3
+    assert vs.cancelled == 2
+    assert vs.finished == 0
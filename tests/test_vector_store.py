@@ -0,0 +1,49 @@
+"""
+Tests for length-bucketed upsert batching
+"""
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from backend.services.chunker import Chunk
+from backend.services.vector_store import batch_by_length, estimate_tokens
+
+
+def make_chunks(lengths):
+    return [
+        Chunk(chunk_id=f"p_chunk_{i}", paper_id="p", section="Intro", page=1, text="x" * length)
+        for i, length in enumerate(lengths)
+    ]
+
+
+def test_batches_respect_batch_size():
+    batches = batch_by_length(make_chunks([10] * 25), batch_size=10, max_tokens=10**6)
+    
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+
+
+def test_batches_respect_token_budget():
+    chunks = make_chunks([400] * 10)
+    per_chunk = estimate_tokens(chunks[0].text)
+    
+    batches = batch_by_length(chunks, batch_size=100, max_tokens=per_chunk * 3)
+    
+    assert [len(batch) for batch in batches] == [3, 3, 3, 1]
+    for batch in batches:
+        assert sum(estimate_tokens(chunk.text) for chunk in batch) <= per_chunk * 3
+
+
+def test_oversized_chunk_gets_its_own_batch():
+    batches = batch_by_length(make_chunks([10, 10, 100000]), batch_size=10, max_tokens=100)
+    
+    assert [len(batch) for batch in batches] == [2, 1]
+
+
+def test_batches_are_sorted_by_length_and_keep_every_chunk():
+    chunks = make_chunks([50, 5, 30, 5, 80, 20])
+    
+    batches = batch_by_length(chunks, batch_size=2, max_tokens=10**6)
+    flat = [chunk for batch in batches for chunk in batch]
+    
+    assert [len(chunk.text) for chunk in flat] == [5, 5, 20, 30, 50, 80]
+    assert {chunk.chunk_id for chunk in flat} == {chunk.chunk_id for chunk in chunks}